@@ -0,0 +1,59 @@
+"""Rename images from a mapping file without the GUI.
+
+Usage:
+    python batch_rename.py DIRECTORY MAPPING [--dry-run] [--quiet]
+
+MAPPING is a CSV (source,name) or JSON file. Each source file in
+DIRECTORY is renamed to its name plus the original extension, with the
+same name_N numbering the GUI uses when a name is already taken.
+"""
+import argparse
+import sys
+
+from renamer_core import batch_rename, load_mapping
+
+
+def print_progress(done, total, result):
+    print(f"{done}/{total} files, {result.rate:.0f} files/s", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rename images in a directory from a mapping file.")
+    parser.add_argument("directory", help="directory containing the images")
+    parser.add_argument("mapping", help="CSV (source,name) or JSON mapping file")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="show what would be renamed without renaming anything")
+    parser.add_argument("--quiet", action="store_true",
+                        help="only print the summary")
+    args = parser.parse_args(argv)
+    
+    try:
+        mapping = load_mapping(args.mapping)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error loading mapping: {str(e)}", file=sys.stderr)
+        return 2
+    
+    try:
+        result = batch_rename(args.directory, mapping, dry_run=args.dry_run,
+                              progress=None if args.quiet else print_progress)
+    except OSError as e:
+        print(f"Error reading directory: {str(e)}", file=sys.stderr)
+        return 2
+    
+    if not args.quiet:
+        prefix = "Would rename" if args.dry_run else "Renamed"
+        for source, new_name in result.renamed:
+            print(f"{prefix} {source} -> {new_name}")
+    for source in result.missing:
+        print(f"Not found: {source}", file=sys.stderr)
+    for source, error in result.failed:
+        print(f"Failed: {source}: {error}", file=sys.stderr)
+    
+    action = "would be renamed" if args.dry_run else "renamed"
+    print(f"{len(result.renamed)} {action}, {len(result.missing)} not found, "
+          f"{len(result.failed)} failed in {result.elapsed:.2f}s ({result.rate:.0f} files/s)")
+    return 1 if result.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
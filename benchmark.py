@@ -0,0 +1,401 @@
+"""Benchmark the renamer's hot paths on synthetic image folders.
+
+Usage:
+    python benchmark.py [--sizes 100,1000,10000] [--mix png=0.6,jpeg=0.35,tiff=0.05]
+                        [--output results.json] [--compare previous.json]
+
+For each folder size a directory of synthetic images is generated (a few
+template images of each kind, hard-linked under many names), together
+with a matching name list. The same code the app runs is then timed
+without a window: listing the folder (load_images), matching used names
+(scan_existing_names), preview decode and resize (display_image, in both
+fast and exact quality), the integrity pre-scan (check_image), exporting
+derived sizes (export_image, then again when all are up to date), burst
+detection (hash_image on a sample of files, group_bursts on a folder's
+worth of hashes), queueing renames with _N collisions the way a click
+does (rename_image) and waiting for them to reach the disk
+(rename_queue_drain), and directory revalidation (refresh_directory).
+
+Results go to a JSON file; --compare prints the change against an
+earlier results file.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Keep journals and caches of the benchmark out of the user's data folder
+_STATE_DIR = tempfile.mkdtemp(prefix="renamer-bench-state-")
+os.environ['LOCALAPPDATA'] = _STATE_DIR
+os.environ['XDG_STATE_HOME'] = _STATE_DIR
+
+from PIL import Image
+
+from bursts import group_similar, image_hash
+from export import export_image, parse_export_sizes
+from integrity import check_image
+from previews import load_preview
+from rename_queue import RenameQueue
+from renamer_core import DirectoryIndex, load_name_list, plan_rename
+
+# Template image sizes for each kind of file in the mix
+KINDS = {
+    "png": ("PNG", ".png", (640, 480)),
+    "jpeg": ("JPEG", ".jpg", (6000, 4000)),     # 24 MP camera photo
+    "tiff": ("TIFF", ".tiff", (8000, 6000)),    # 48 MP scan or panorama
+}
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def read_peak_rss():
+    """Peak resident memory of this process in bytes, or None if unknown"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+        return None
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        return None
+
+
+def reset_peak_rss():
+    """Reset the peak RSS counter where the OS allows it (Linux only)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+class Stage:
+    """Times the operations of one benchmark stage"""
+
+    def __init__(self, name, files):
+        self.name = name
+        self.files = files
+        self.samples = []
+
+    def __enter__(self):
+        reset_peak_rss()
+        tracemalloc.start()
+        self.start = time.perf_counter()
+        return self
+
+    def time(self, func, *args):
+        """Run func once and record how long it took"""
+        start = time.perf_counter()
+        result = func(*args)
+        self.samples.append(time.perf_counter() - start)
+        return result
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.start
+        self.python_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.peak_rss = read_peak_rss()
+
+    def result(self):
+        ms = [sample * 1000 for sample in self.samples]
+
+        def rounded(value):
+            return None if value is None else round(value, 3)
+        return {
+            "stage": self.name,
+            "files": self.files,
+            "ops": len(ms),
+            "wall_s": round(self.wall, 4),
+            "mean_ms": rounded(sum(ms) / len(ms)) if ms else None,
+            "p50_ms": rounded(percentile(ms, 0.50)),
+            "p90_ms": rounded(percentile(ms, 0.90)),
+            "p99_ms": rounded(percentile(ms, 0.99)),
+            "max_ms": rounded(max(ms)) if ms else None,
+            "python_peak_mb": round(self.python_peak / 2 ** 20, 2),
+            "peak_rss_mb": None if self.peak_rss is None else round(self.peak_rss / 2 ** 20, 1),
+        }
+
+
+def parse_mix(text):
+    """Parse "png=0.6,jpeg=0.4" into normalised fractions"""
+    mix = {}
+    for part in text.split(","):
+        kind, _, fraction = part.partition("=")
+        kind = kind.strip().lower()
+        if kind not in KINDS:
+            raise ValueError(f"Unknown image kind '{kind}' (choose from {', '.join(KINDS)})")
+        mix[kind] = float(fraction or 1)
+    total = sum(mix.values())
+    return {kind: fraction / total for kind, fraction in mix.items() if fraction > 0}
+
+
+def make_templates(template_dir, mix, per_kind, rng):
+    """Create a few distinct images of each kind to link the corpus from"""
+    templates = {}
+    for kind in mix:
+        image_format, ext, size = KINDS[kind]
+        templates[kind] = []
+        for n in range(per_kind):
+            path = os.path.join(template_dir, f"{kind}_{n}{ext}")
+            if kind == "tiff":
+                img = Image.effect_mandelbrot(size, (-2.0 + rng.random() * 0.1, -1.2, 1.0, 1.2), 64)
+                img = Image.merge("RGB", (img, img.point(lambda v: 255 - v), img))
+                img.save(path, image_format, compression="tiff_lzw")
+            else:
+                img = Image.effect_noise(size, 40 + n * 5).convert("RGB")
+                img.save(path, image_format, **({"quality": 90} if image_format == "JPEG" else {}))
+            templates[kind].append(path)
+    return templates
+
+
+def make_corpus(directory, count, mix, templates, names, named_fraction, rng):
+    """Fill directory with count images following mix; some already named"""
+    os.makedirs(directory)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    for n in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        source = rng.choice(templates[kind])
+        ext = os.path.splitext(source)[1]
+        if rng.random() < named_fraction:
+            # A file already carrying a list name, with a random suffix
+            filename = f"{rng.choice(names)}_{n}{ext}"
+        else:
+            filename = f"IMG_{n:06d}{ext}"
+        target = os.path.join(directory, filename)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+
+
+def make_burst_hashes(count, rng):
+    """Make count image hashes in bursts of 1 to 5 shots a few bits apart"""
+    hashes = []
+    while len(hashes) < count:
+        scene = rng.getrandbits(64)
+        for _ in range(rng.randint(1, 5)):
+            shot = scene
+            for _ in range(rng.randint(0, 4)):
+                shot ^= 1 << rng.randrange(64)
+            hashes.append(shot)
+    return hashes[:count]
+
+
+def run_size(work_dir, count, args, mix, templates, rng):
+    """Run every stage on one generated folder; return the stage results"""
+    names = [f"Room {n:03d}" for n in range(args.names)]
+    namelist_path = os.path.join(work_dir, f"names_{count}.txt")
+    with open(namelist_path, 'w') as file:
+        file.write("\n".join(names) + "\n")
+
+    directory = os.path.join(work_dir, f"images_{count}")
+    make_corpus(directory, count, mix, templates, names, args.named_fraction, rng)
+    results = []
+
+    # load_images: check the rename journal and list the folder, like scan_directory
+    def load_images():
+        rename_queue = RenameQueue(directory)
+        rename_queue.recover()
+        rename_queue.close()
+        return DirectoryIndex(directory)
+
+    with Stage("load_images", count) as stage:
+        for _ in range(args.repeat):
+            dir_index = stage.time(load_images)
+        image_files = dir_index.images()
+    results.append(stage.result())
+
+    # scan_existing_names: load the name list and match it against the folder
+    with Stage("scan_existing_names", count) as stage:
+        for _ in range(args.repeat):
+            stage.time(lambda: dir_index.name_index.used_names(load_name_list(namelist_path)))
+    results.append(stage.result())
+
+    # display_image: decode and resize a sample of files in both quality modes
+    sample = rng.sample(image_files, min(args.decode_samples, len(image_files)))
+    for quality in ("fast", "exact"):
+        with Stage(f"display_image_{quality}", count) as stage:
+            for filename in sample:
+                stage.time(load_preview, os.path.join(directory, filename), (700, 500), quality)
+        results.append(stage.result())
+
+    # Integrity pre-scan: verify and decode the same sample, as each worker process does
+    with Stage("check_image", count) as stage:
+        for filename in sample:
+            stage.time(check_image, os.path.join(directory, filename))
+    results.append(stage.result())
+
+    # Export: make web and report copies of the same sample, then check them again (all up to date)
+    export_dir = os.path.join(work_dir, f"exports_{count}")
+    export_sizes = parse_export_sizes("web 1600x1600 jpeg, report 800x800 jpeg")
+    for name in ("export_image", "export_image_current"):
+        with Stage(name, count) as stage:
+            for filename in sample:
+                stage.time(export_image, os.path.join(directory, filename), filename, export_dir, export_sizes)
+        results.append(stage.result())
+    shutil.rmtree(export_dir, ignore_errors=True)
+
+    # Burst detection: hash the same sample, then group hashes for the whole folder
+    with Stage("hash_image", count) as stage:
+        for filename in sample:
+            stage.time(image_hash, os.path.join(directory, filename))
+    results.append(stage.result())
+    burst_hashes = make_burst_hashes(count, rng)
+    with Stage("group_bursts", count) as stage:
+        for _ in range(args.repeat):
+            stage.time(group_similar, burst_hashes)
+    results.append(stage.result())
+
+    # rename_image: what a click waits for in the app, i.e. reserving the
+    # name (with _N suffixes piling up on a handful of names) and queueing
+    # the rename with its fsync'd journal record; the renames themselves run
+    # on the queue's worker thread
+    to_rename = rng.sample(image_files, min(args.renames, len(image_files)))
+    rename_queue = RenameQueue(directory)
+    rename_queue.recover()
+
+    def queue_rename(filename, name):
+        rename_queue.submit(filename, plan_rename(dir_index, filename, name))
+
+    with Stage("rename_image", count) as stage:
+        for filename in to_rename:
+            stage.time(queue_rename, filename, rng.choice(names[:args.collision_names]))
+    results.append(stage.result())
+
+    # rename_queue_drain: until the queued renames have all reached the disk
+    with Stage("rename_queue_drain", count) as stage:
+        stage.time(rename_queue.close, 600)
+        failed = [op for op in rename_queue.poll() if op["status"] == "failed"]
+        dir_index.touch()
+    if failed:
+        print(f"  {len(failed)} queued renames failed, e.g. {failed[0]['src']}: {failed[0]['error']}")
+    results.append(stage.result())
+
+    # refresh_directory: unchanged folder (one stat), then a forced rescan
+    with Stage("refresh_directory", count) as stage:
+        for _ in range(args.repeat):
+            stage.time(dir_index.revalidate)
+    results.append(stage.result())
+    with Stage("refresh_directory_forced", count) as stage:
+        for _ in range(args.repeat):
+            stage.time(dir_index.scan)
+    results.append(stage.result())
+
+    shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def compare(results, previous_path):
+    """Print the change in p50 and wall time against an earlier run"""
+    with open(previous_path, 'r') as file:
+        previous = {(r["stage"], r["files"]): r for r in json.load(file)["results"]}
+    print(f"\nCompared with {previous_path}:")
+    for result in results:
+        old = previous.get((result["stage"], result["files"]))
+        if not old:
+            continue
+        parts = []
+        for key in ("p50_ms", "wall_s"):
+            if old.get(key) and result.get(key) is not None:
+                parts.append(f"{key} {(result[key] / old[key] - 1) * 100:+.1f}%")
+        print(f"  {result['stage']:<26} {result['files']:>7} files  {'  '.join(parts)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the image renamer's hot paths.")
+    parser.add_argument("--sizes", default="100,1000,10000",
+                        help="comma-separated folder sizes (default: 100,1000,10000)")
+    parser.add_argument("--mix", default="png=0.6,jpeg=0.35,tiff=0.05",
+                        help="kinds of images and their shares (png, jpeg, tiff)")
+    parser.add_argument("--names", type=int, default=40, help="names in the generated name list")
+    parser.add_argument("--named-fraction", type=float, default=0.2,
+                        help="share of files that already carry a list name")
+    parser.add_argument("--decode-samples", type=int, default=10, help="images decoded per size")
+    parser.add_argument("--renames", type=int, default=200, help="renames per size")
+    parser.add_argument("--collision-names", type=int, default=3,
+                        help="names the renames are spread over (fewer means more _N suffixes)")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions of the listing stages")
+    parser.add_argument("--templates", type=int, default=2, help="distinct images per kind")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    parser.add_argument("--work-dir", help="where to generate the folders (default: a temp folder)")
+    parser.add_argument("--output", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="renamer-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+
+    print(f"Generating template images in {work_dir}...")
+    template_dir = os.path.join(work_dir, "templates")
+    os.makedirs(template_dir, exist_ok=True)
+    templates = make_templates(template_dir, mix, args.templates, rng)
+
+    results = []
+    for count in sizes:
+        print(f"Benchmarking {count} files...")
+        for result in run_size(work_dir, count, args, mix, templates, rng):
+            results.append(result)
+            print(f"  {result['stage']:<26} ops {result['ops']:>5}  wall {result['wall_s']:>8.3f}s  "
+                  f"p50 {result['p50_ms']} ms  p90 {result['p90_ms']} ms  p99 {result['p99_ms']} ms  "
+                  f"peak RSS {result['peak_rss_mb']} MB")
+
+    with open(args.output, 'w') as file:
+        json.dump({
+            "meta": {
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "pillow": Image.__version__,
+                "platform": platform.platform(),
+                "args": vars(args),
+            },
+            "results": results,
+        }, file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    shutil.rmtree(_STATE_DIR, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,10 +2,12 @@
 echo Building Image Renamer executable...
 
 pip install pyinstaller
-pyinstaller --onefile --windowed --name ImageRenamer image_renamer.py
+rem --onedir starts much faster than --onefile, which unpacks itself to a
+rem temporary folder on every launch
+pyinstaller --onedir --windowed --noconfirm --name ImageRenamer image_renamer.py
 
 echo.
-echo Build complete! Executable can be found in the "dist" folder.
-echo Don't forget to copy config.ini and namelist.txt to the same directory as the executable.
+echo Build complete! The program can be found in the "dist\ImageRenamer" folder.
+echo Don't forget to copy config.ini and namelist.txt into that folder, next to ImageRenamer.exe.
 echo.
-pause
\ No newline at end of file
+pause
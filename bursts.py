@@ -0,0 +1,261 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from instrumentation import timings
+from previews import DEFAULT_MEMORY_LIMIT, PreviewTooLarge, decode_source, exif_thumbnail
+
+try:
+    import numpy as np
+except ImportError:
+    # Without NumPy only neighbouring images are compared
+    np = None
+
+# Hash size: the image is shrunk to HASH_WIDTH + 1 x HASH_HEIGHT greys
+HASH_WIDTH = 8
+HASH_HEIGHT = 8
+
+# Images whose hashes differ in at most this many of the 64 bits are treated as one burst
+DEFAULT_THRESHOLD = 6
+
+# Without NumPy, how many following images every hash is compared with
+DEFAULT_WINDOW = 8
+
+
+
+def image_hash(image_path, max_bytes=DEFAULT_MEMORY_LIMIT):
+    """Compute the 64-bit difference hash of an image file
+
+    Each bit says whether a pixel of a tiny greyscale copy is brighter than
+    its right-hand neighbour, so small changes between the shots of a burst
+    flip only a few bits. The copy is made from the EXIF thumbnail when
+    there is one, otherwise from a reduced decode; the full image is never
+    decoded. Returns None for files that cannot be read.
+    """
+    with timings.stage("hash"):
+        try:
+            with Image.open(image_path) as img:
+                small = exif_thumbnail(img, max_bytes)
+                if small is None:
+                    small = decode_source(img, (64, 64), "fast", max_bytes)
+                grey = small.convert("L").resize((HASH_WIDTH + 1, HASH_HEIGHT), Image.BILINEAR)
+        except (OSError, ValueError, PreviewTooLarge):
+            return None
+
+    pixels = list(grey.getdata())
+    value = 0
+    for row in range(HASH_HEIGHT):
+        start = row * (HASH_WIDTH + 1)
+        for col in range(HASH_WIDTH):
+            value = (value << 1) | (pixels[start + col] > pixels[start + col + 1])
+    return value
+
+
+def hamming_distance(first, second):
+    """Count the bits that differ between two hashes"""
+    return bin(first ^ second).count("1")
+
+
+if np is not None and hasattr(np, "bitwise_count"):
+    # NumPy 2.0 counts bits with the CPU's popcount instruction
+    _popcount = np.bitwise_count
+elif np is not None:
+    # Set bits in each byte value, for counting bits of uint64 arrays bytewise
+    _BYTE_BITS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(values):
+        return _BYTE_BITS[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def band_bits(threshold):
+    """Width of the bands the hashes are sorted by (see find_similar_pairs)
+
+    Hashes within threshold bits of each other agree on at least one of
+    threshold + 1 bands, so the hash is cut into that many bands or more.
+    """
+    bits = 64
+    while bits > 1 and 64 // bits <= threshold:
+        bits //= 2
+    return bits
+
+
+def find_similar_pairs(hashes, keys=None, threshold=DEFAULT_THRESHOLD, window=DEFAULT_WINDOW):
+    """Find pairs of positions whose hashes are within threshold bits
+
+    hashes is a list of ints (None for images that could not be hashed);
+    keys, if given, limits pairs to positions with equal keys (the folder
+    of each image). Rather than comparing every pair, the hash is cut into
+    bands narrow enough that two hashes within threshold bits of each
+    other (up to 63) agree on at least one of them: 8 bands of 8 bits up
+    to 7 bits. For each band the hashes are sorted by folder and band, and
+    every hash is compared with all the others in its run of equal
+    folder and band, so no close pair is missed. With NumPy each step
+    along the runs is one vectorized comparison, so tens of thousands of
+    images take a fraction of a second. Without it each hash is only
+    compared with the next window hashes in the given order (bursts are
+    usually shot one after the other), which can miss pairs.
+    """
+    present = [i for i, value in enumerate(hashes) if value is not None]
+    if keys is None:
+        keys = [0] * len(hashes)
+
+    if np is None:
+        pairs = []
+        for n, i in enumerate(present):
+            for j in present[n + 1:n + 1 + window]:
+                if keys[i] == keys[j] and hamming_distance(hashes[i], hashes[j]) <= threshold:
+                    pairs.append((i, j))
+        return pairs
+
+    if len(present) < 2:
+        return []
+    positions = np.array(present)
+    values = np.array([hashes[i] for i in present], dtype=np.uint64)
+    group_ids = {}
+    groups = np.array([group_ids.setdefault(keys[i], len(group_ids)) for i in present])
+
+    pairs = []
+    bits = band_bits(threshold)
+    for shift in range(0, 64, bits):
+        band = (values >> np.uint64(shift)) & np.uint64(2 ** bits - 1)
+        order = np.lexsort((band, groups))
+        sorted_values = values[order]
+        sorted_groups = groups[order]
+        sorted_band = band[order]
+        # Number the runs of equal folder and band
+        boundaries = (sorted_groups[1:] != sorted_groups[:-1]) | (sorted_band[1:] != sorted_band[:-1])
+        sorted_runs = np.concatenate(([0], np.cumsum(boundaries)))
+
+        # Compare each hash with the one step places on, for as long as
+        # any of them are still in the same run
+        starts = np.arange(len(order) - 1)
+        step = 1
+        while len(starts):
+            starts = starts[sorted_runs[starts] == sorted_runs[starts + step]]
+            close = starts[_popcount(sorted_values[starts] ^ sorted_values[starts + step]) <= threshold]
+            pairs.append(np.stack((order[close], order[close + step]), axis=1))
+            step += 1
+            starts = starts[starts + step < len(order)]
+
+    # Drop pairs found by more than one band
+    pairs = np.concatenate(pairs)
+    codes = np.unique(pairs.min(axis=1).astype(np.int64) * len(values) + pairs.max(axis=1))
+    first, second = np.divmod(codes, len(values))
+    return list(zip(positions[first].tolist(), positions[second].tolist()))
+
+
+def group_similar(hashes, keys=None, threshold=DEFAULT_THRESHOLD, window=DEFAULT_WINDOW):
+    """Group positions of near-identical images; returns sorted lists of 2 or more
+
+    Identical hashes in one folder are joined up front and only one of
+    each is passed to find_similar_pairs, whose output would otherwise
+    grow with the square of the number of copies.
+    """
+    if keys is None:
+        keys = [0] * len(hashes)
+    first_seen = {}
+    unique = []                         # Positions of the first image with each (key, hash)
+    pairs = []
+    for i, value in enumerate(hashes):
+        if value is None:
+            continue
+        seen = first_seen.setdefault((keys[i], value), i)
+        if seen != i:
+            pairs.append((seen, i))
+        else:
+            unique.append(i)
+    similar = find_similar_pairs([hashes[i] for i in unique], [keys[i] for i in unique], threshold, window)
+    pairs += [(unique[a], unique[b]) for a, b in similar]
+
+    parent = {}
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in pairs:
+        parent.setdefault(i, i)
+        parent.setdefault(j, j)
+        first, second = find(i), find(j)
+        if first != second:
+            parent[max(first, second)] = min(first, second)
+
+    groups = {}
+    for i in parent:
+        groups.setdefault(find(i), []).append(i)
+    return sorted(sorted(members) for members in groups.values())
+
+
+class BurstFinder:
+    """Hashes a session's images on background threads and groups the bursts
+
+    start() begins a pass over a list of image paths; the Tk main thread
+    polls result(), which returns None until the pass is finished and
+    then the groups as lists of positions in that list. A pass that fails
+    stops running with result() None and the message in error.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, workers=2, max_bytes=DEFAULT_MEMORY_LIMIT):
+        self.threshold = threshold
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.done = 0
+        self.total = 0
+        self._groups = None
+        self._stop = None
+        self.error = None
+
+    def start(self, paths, keys=None):
+        """Start hashing paths; keys (e.g. folders) keep groups apart"""
+        self.stop()
+        stop = threading.Event()
+        self._stop = stop
+        self._groups = None
+        self.error = None
+        self.done = 0
+        self.total = len(paths)
+
+        def run():
+            try:
+                hashes = []
+                with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="burst-hash") as executor:
+                    # Submit in chunks so that stop() takes effect quickly
+                    for start in range(0, len(paths), 64):
+                        if stop.is_set():
+                            return
+                        chunk = paths[start:start + 64]
+                        try:
+                            hashes.extend(executor.map(lambda path: image_hash(path, self.max_bytes), chunk))
+                        except RuntimeError:
+                            # The interpreter is shutting down
+                            return
+                        self.done = len(hashes)
+                groups = group_similar(hashes, keys, self.threshold)
+                if not stop.is_set():
+                    self._groups = groups
+            except Exception as e:
+                if not stop.is_set():
+                    print(f"Error finding bursts: {str(e)}")
+                    self.error = str(e) or type(e).__name__
+            finally:
+                # However the pass ended, it is no longer running
+                stop.set()
+
+        threading.Thread(target=run, name="burst-finder", daemon=True).start()
+
+    def result(self):
+        """Get the groups once the pass is finished, else None"""
+        return self._groups
+
+    def is_running(self):
+        return self._stop is not None and self._groups is None and not self._stop.is_set()
+
+    def stop(self):
+        """Abandon the current pass"""
+        if self._stop is not None:
+            self._stop.set()
+        self._stop = None
+        self._groups = None
@@ -0,0 +1,196 @@
+import os
+
+from PIL import Image
+
+from previews import (DEFAULT_MEMORY_LIMIT, apply_orientation, decode_source, exif_orientation,
+                      fit_size, stored_box)
+from workers import ProcessJob
+
+# File extension written for each export format
+FORMAT_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+
+# Modes each format can store; anything else is converted to RGB (RGBA if it has alpha and may keep it)
+FORMAT_MODES = {
+    "JPEG": ("L", "RGB"),
+    "PNG": ("1", "L", "LA", "P", "RGB", "RGBA"),
+    "WEBP": ("RGB", "RGBA"),
+}
+
+
+def parse_export_sizes(text):
+    """Parse the export_sizes setting into (name, (width, height), format) tuples
+
+    Sizes are separated by commas, each written as "name WIDTHxHEIGHT
+    format", e.g. "web 1600x1600 jpeg, report 800x800 png". Raises
+    ValueError for anything else.
+    """
+    sizes = []
+    for entry in text.split(","):
+        if not entry.strip():
+            continue
+        try:
+            name, box, image_format = entry.split()
+            width, height = (int(value) for value in box.lower().split("x"))
+        except ValueError:
+            raise ValueError(f"Export size {entry.strip()!r} is not written as: name WIDTHxHEIGHT format")
+        image_format = image_format.upper().replace("JPG", "JPEG")
+        if image_format not in FORMAT_EXTENSIONS:
+            raise ValueError(f"Export format {image_format!r} is not one of jpeg, png, webp")
+        if width < 1 or height < 1:
+            raise ValueError(f"Export size {entry.strip()!r} must be at least 1x1")
+        sizes.append((name, (width, height), image_format))
+    return sizes
+
+
+def export_path(export_dir, size_name, relative_path, image_format):
+    """Get where the export of a session image at one size goes
+
+    Exports keep the image's folder and name under a folder per size.
+    The extension is swapped for the format's; a file whose own
+    extension is different keeps it, so "Kitchen.png" exported as JPEG
+    becomes "Kitchen.png.jpg" and never overwrites the export of a
+    "Kitchen.jpg" next to it.
+    """
+    extension = FORMAT_EXTENSIONS[image_format]
+    stem, own_extension = os.path.splitext(relative_path)
+    if own_extension.lower() in (extension, ".jpeg" if extension == ".jpg" else extension):
+        relative_path = stem
+    return os.path.join(export_dir, size_name, relative_path + extension)
+
+
+def export_size(image_size, orientation, box):
+    """Size of an export: the upright image fitted inside box, never enlarged"""
+    if orientation >= 5:
+        image_size = (image_size[1], image_size[0])
+    if image_size[0] <= box[0] and image_size[1] <= box[1]:
+        return image_size
+    return fit_size(image_size, box)
+
+
+def is_current(path, mtime, size, image_format):
+    """Check that an export exists, was made from this version of the source and has the right size"""
+    try:
+        if os.stat(path).st_mtime_ns != mtime:
+            return False
+        with Image.open(path) as img:
+            return img.format == image_format and img.size == size
+    except Exception:
+        return False
+
+
+def export_image(source_path, relative_path, export_dir, sizes, quality=85,
+                 max_bytes=DEFAULT_MEMORY_LIMIT, previous_path=None):
+    """Make the exports of one image that are missing or out of date
+
+    Exports carry the source's mtime, so an export whose mtime, format and
+    size all match is up to date and is left alone; exporting a folder
+    again after an interruption only makes what is missing. If
+    previous_path (the image's relative path before a rename) still has
+    up-to-date exports, they are moved to the new name instead of being
+    made again. Otherwise the source is decoded once, at the largest size
+    needed and within max_bytes, and every export is resized from that.
+    Returns a dict counting the exports made, moved and already current.
+    """
+    counts = {"made": 0, "moved": 0, "current": 0}
+    mtime = os.stat(source_path).st_mtime_ns
+    with Image.open(source_path) as img:
+        orientation = exif_orientation(img)
+        icc_profile = img.info.get("icc_profile")
+        wanted = []
+        for name, box, image_format in sizes:
+            size = export_size(img.size, orientation, box)
+            target = export_path(export_dir, name, relative_path, image_format)
+            if is_current(target, mtime, size, image_format):
+                counts["current"] += 1
+                continue
+            if previous_path:
+                previous = export_path(export_dir, name, previous_path, image_format)
+                if is_current(previous, mtime, size, image_format):
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.replace(previous, target)
+                    counts["moved"] += 1
+                    continue
+            wanted.append((target, size, image_format))
+        if not wanted:
+            return counts
+
+        # One decode serves every size
+        largest = (max(size[0] for _, size, _ in wanted), max(size[1] for _, size, _ in wanted))
+        source = apply_orientation(decode_source(img, stored_box(largest, orientation), "fast", max_bytes),
+                                   orientation)
+
+    for target, size, image_format in wanted:
+        export = source if source.size == size else source.resize(size, Image.LANCZOS)
+        modes = FORMAT_MODES[image_format]
+        if export.mode not in modes:
+            export = export.convert("RGBA" if "RGBA" in modes and "A" in export.getbands() else "RGB")
+        options = {"quality": quality} if image_format in ("JPEG", "WEBP") else {}
+        if icc_profile:
+            options["icc_profile"] = icc_profile
+
+        # Written under a temporary name so an interrupted export never looks finished
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp_path = f"{target}.{os.getpid()}.tmp"
+        export.save(temp_path, image_format, **options)
+        os.utime(temp_path, ns=(mtime, mtime))
+        os.replace(temp_path, target)
+        counts["made"] += 1
+    return counts
+
+
+def remove_exports(export_dir, sizes, relative_path):
+    """Delete the exports of a session image (after its rename was undone)"""
+    removed = 0
+    for name, _, image_format in sizes:
+        try:
+            os.remove(export_path(export_dir, name, relative_path, image_format))
+            removed += 1
+        except FileNotFoundError:
+            continue
+    return {"removed": removed}
+
+
+def export_images(items, sizes, quality, max_bytes):
+    """Worker process task: handle a chunk of (source_path, export_dir, relative_path, previous_path)
+
+    Items without a source_path remove the exports of previous_path.
+    """
+    results = []
+    for source_path, export_dir, relative_path, previous_path in items:
+        try:
+            if source_path is None:
+                results.append(remove_exports(export_dir, sizes, previous_path))
+            else:
+                results.append(export_image(source_path, relative_path, export_dir, sizes,
+                                            quality, max_bytes, previous_path))
+        except Exception as e:
+            results.append({"error": str(e) or type(e).__name__, "path": relative_path or previous_path})
+    return results
+
+
+class ExportJob(ProcessJob):
+    """Exports images to the configured sizes in a pool of worker processes
+
+    export() and discard() queue work under a key; take() returns (key,
+    result) pairs with result as from export_image or remove_exports, or
+    {"error": message, "path": relative_path}. Each worker handles one
+    image at a time and decodes it within max_bytes, so the pool's memory
+    use is bounded by workers x max_bytes.
+    """
+
+    def __init__(self, sizes, quality=85, workers=0, max_bytes=DEFAULT_MEMORY_LIMIT):
+        super().__init__(export_images, (sizes, quality, max_bytes), workers,
+                         chunk_size=1, name="export")
+        self.sizes = sizes
+
+    def export(self, key, source_path, export_dir, relative_path, previous_path=None):
+        """Queue an image for exporting; previous_path is its name before a rename"""
+        self.submit([(key, (source_path, export_dir, relative_path, previous_path))])
+
+    def discard(self, key, export_dir, relative_path):
+        """Queue removing the exports of an image that no longer carries this name"""
+        self.submit([(key, (None, export_dir, None, relative_path))])
+
+    def crashed(self, value, error):
+        _, _, relative_path, previous_path = value
+        return {"error": f"The export process crashed ({error})", "path": relative_path or previous_path}
@@ -0,0 +1,220 @@
+import tkinter as tk
+from PIL import ImageTk
+
+# Tile outline colours for each image state
+STATE_COLORS = {
+    "current": "#1e64c8",
+    "renamed": "red",
+    "used": "#e08000",
+    "missing": "gray",
+    "damaged": "#9000c0",
+    "normal": "#d0d0d0",
+}
+
+
+class Filmstrip(tk.Frame):
+    """Horizontally scrolling strip of thumbnails for the images in a folder
+
+    Only the tiles that are in view exist on the canvas, and only those
+    tiles hold a PhotoImage, so the strip costs the same with 50 images
+    as with 50,000. Thumbnails are decoded by a Prefetcher on worker
+    threads; the strip polls its cache from the Tk main thread.
+
+    get_path(index) returns the current path for a display index (or None),
+    get_state(index) returns (label, state) with state a key of
+    STATE_COLORS, and on_select(index) is called when a tile is clicked.
+    """
+
+    def __init__(self, master, thumbnailer, get_path, get_state, on_select,
+                 thumb_size=(96, 72)):
+        super().__init__(master)
+        self.thumbnailer = thumbnailer
+        self.get_path = get_path
+        self.get_state = get_state
+        self.on_select = on_select
+        self.thumb_size = thumb_size
+        self.tile_width = thumb_size[0] + 16
+        self.tile_height = thumb_size[1] + 28
+
+        self.count = 0
+        self.current = None
+        self.offset = 0                 # Scroll position in pixels
+        self.tiles = {}                 # Maps display indexes to canvas item ids
+        self.photos = {}                # PhotoImages of the visible tiles only
+        self.poll_job = None
+
+        self.canvas = tk.Canvas(self, height=self.tile_height, highlightthickness=0)
+        self.canvas.pack(fill=tk.X)
+        self.scrollbar = tk.Scrollbar(self, orient=tk.HORIZONTAL, command=self.xview)
+        self.scrollbar.pack(fill=tk.X)
+
+        self.canvas.bind("<Configure>", lambda event: self.redraw())
+        self.canvas.bind("<Button-1>", self.on_click)
+        self.canvas.bind("<MouseWheel>", self.on_mousewheel)
+        self.canvas.bind("<Button-4>", lambda event: self.xview("scroll", -1, "units"))
+        self.canvas.bind("<Button-5>", lambda event: self.xview("scroll", 1, "units"))
+
+    def set_count(self, count):
+        """Show a new set of images, scrolled to the start"""
+        self.count = count
+        self.current = None
+        self.offset = 0
+        self.clear()
+        self.redraw()
+
+    def extend(self, count):
+        """Grow the strip to count images, keeping the scroll position"""
+        self.count = count
+        self.redraw()
+
+    def set_current(self, index):
+        """Highlight the current image and scroll it into view"""
+        previous = self.current
+        self.current = index
+
+        view_width = self.canvas.winfo_width()
+        left = index * self.tile_width
+        if left < self.offset or left + self.tile_width > self.offset + view_width:
+            # Centre the current tile
+            self.scroll_to(left - (view_width - self.tile_width) // 2)
+
+        for i in (previous, index):
+            if i is not None and i in self.tiles:
+                self.delete_tile(i)
+        self.redraw()
+
+    def refresh(self, index=None):
+        """Redraw one tile, or all visible tiles, after its state changed"""
+        if index is None:
+            self.clear()
+        elif index in self.tiles:
+            self.delete_tile(index)
+        self.redraw()
+
+    def clear(self):
+        """Remove every tile from the canvas"""
+        self.canvas.delete("all")
+        self.tiles = {}
+        self.photos = {}
+
+    def delete_tile(self, index):
+        for item in self.tiles.pop(index, ()):
+            self.canvas.delete(item)
+        self.photos.pop(index, None)
+
+    def visible_range(self):
+        """Get the first and last+1 display indexes that are in view"""
+        view_width = max(self.canvas.winfo_width(), self.tile_width)
+        first = max(0, self.offset // self.tile_width)
+        last = min(self.count, (self.offset + view_width) // self.tile_width + 1)
+        return first, last
+
+    def clamp_offset(self):
+        view_width = self.canvas.winfo_width()
+        max_offset = max(0, self.count * self.tile_width - view_width)
+        self.offset = int(min(max(self.offset, 0), max_offset))
+
+    def redraw(self):
+        """Create tiles that scrolled into view and drop the ones that left"""
+        first, last = self.visible_range()
+
+        for index in [i for i in self.tiles if not first <= i < last]:
+            self.delete_tile(index)
+
+        paths = []
+        for index in range(first, last):
+            if index not in self.tiles:
+                self.draw_tile(index)
+            path = self.get_path(index)
+            if path and index not in self.photos:
+                paths.append(path)
+
+        # Decode missing thumbnails in the background, cancelling stale ones
+        self.thumbnailer.prefetch(paths, self.thumb_size)
+        if paths:
+            self.schedule_poll()
+
+        # Update the scrollbar
+        total = max(self.count * self.tile_width, 1)
+        view_width = self.canvas.winfo_width()
+        self.scrollbar.set(self.offset / total, min(1.0, (self.offset + view_width) / total))
+
+    def draw_tile(self, index):
+        """Draw the outline, thumbnail (if ready) and label of one tile"""
+        x = index * self.tile_width - self.offset
+        label, state = self.get_state(index)
+        if index == self.current:
+            state = "current"
+
+        items = [
+            self.canvas.create_rectangle(x + 3, 2, x + self.tile_width - 3, self.tile_height - 2,
+                                         outline=STATE_COLORS[state],
+                                         width=3 if state in ("current", "renamed", "used", "damaged") else 1),
+            self.canvas.create_text(x + self.tile_width // 2, self.tile_height - 12,
+                                    text=label, width=self.tile_width - 8, font=("Arial", 7)),
+        ]
+
+        path = self.get_path(index)
+        if path:
+            img = self.thumbnailer.cache.get((path, self.thumb_size))
+            if img is not None:
+                photo = ImageTk.PhotoImage(img)
+                self.photos[index] = photo
+                items.append(self.canvas.create_image(x + self.tile_width // 2, 6 + self.thumb_size[1] // 2,
+                                                      image=photo))
+            elif self.thumbnailer.failure(path, self.thumb_size):
+                self.photos[index] = None
+                items.append(self.canvas.create_text(x + self.tile_width // 2, 6 + self.thumb_size[1] // 2,
+                                                     text="Unreadable", fill="red", font=("Arial", 8)))
+        self.tiles[index] = items
+
+    def schedule_poll(self):
+        if self.poll_job is None:
+            self.poll_job = self.after(100, self.poll)
+
+    def poll(self):
+        """Put thumbnails that finished decoding into their tiles"""
+        self.poll_job = None
+        first, last = self.visible_range()
+        waiting = False
+
+        for index in range(first, last):
+            if index in self.photos:
+                continue
+            path = self.get_path(index)
+            if not path:
+                continue
+            if (path, self.thumb_size) in self.thumbnailer.cache or self.thumbnailer.failure(path, self.thumb_size):
+                self.delete_tile(index)
+                self.draw_tile(index)
+            elif self.thumbnailer.is_pending(path, self.thumb_size):
+                waiting = True
+
+        if waiting:
+            self.schedule_poll()
+
+    def scroll_to(self, offset):
+        """Scroll so that the strip starts offset pixels in"""
+        old_offset = self.offset
+        self.offset = offset
+        self.clamp_offset()
+        
+        # Shift the existing tiles; redraw() adds and removes tiles at the edges
+        self.canvas.move("all", old_offset - self.offset, 0)
+
+    def xview(self, *args):
+        """Scrollbar command: ("moveto", fraction) or ("scroll", n, "units"/"pages")"""
+        if args[0] == "moveto":
+            self.scroll_to(float(args[1]) * self.count * self.tile_width)
+        elif args[0] == "scroll":
+            step = self.tile_width if args[2] == "units" else self.canvas.winfo_width()
+            self.scroll_to(self.offset + int(args[1]) * step)
+        self.redraw()
+
+    def on_mousewheel(self, event):
+        self.xview("scroll", -1 if event.delta > 0 else 1, "units")
+
+    def on_click(self, event):
+        index = int((event.x + self.offset) // self.tile_width)
+        if 0 <= index < self.count:
+            self.on_select(index)
@@ -1,27 +1,128 @@
+import time
+
+# Taken before anything else is imported so startup timing covers the imports
+PROCESS_START = time.perf_counter()
+
 import os
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from PIL import Image, ImageTk
 import configparser
+import json
+import multiprocessing
+import queue
 import sys
+import threading
+
+# PIL, the preview caches and the filmstrip are imported after the window
+# is first drawn (see finish_startup) to keep them off the startup path
+from instrumentation import StartupTimer, timings
+from name_panel import NamePanel
+from rename_queue import RenameQueue
+from renamer_core import (app_data_dir, is_image_file, load_name_list, plan_rename, session_base,
+                          split_suffix, state_path, walk_directories)
+from session_state import SessionState
+from watcher import create_watcher
+
+# Stages shown by the latency overlay, in pipeline order
+OVERLAY_STAGES = ("display", "decode", "resize", "photo", "rename", "os_rename", "scan", "revalidate")
 
 class ImageRenamerApp:
-    def __init__(self, root):
+    def __init__(self, root, log_startup_timing=False, profile=False):
         self.root = root
         self.root.title("Image Renamer Tool")
         self.root.geometry("900x700")
         
         # Initialize variables
-        self.image_files = []           # Current directory listing
-        self.display_order = []         # Fixed order of images
-        self.filename_map = {}          # Maps display indexes to current filenames
+        self.dir_indexes = {}           # Maps session folders (relative to image_dir) to listings
+        self.dir_entries = {}           # Maps session folders to the display indexes of their images
+        self.roots = []                 # Folders chosen for the session
+        self.session_recursive = False  # Whether the session includes subfolders
+        self.last_rename_id = 0         # Journal id of the last rename filename_map includes
+        self.rename_queue = None        # Background renames for the session
+        self.session_state = None       # Saved copy of the session for resuming it
+        self.watcher = None             # Reports changes made by other programs
+        self.watch_job = None
+        self.expected_renames = {}      # Maps paths the app is renaming to their new paths
+        self.waiting_folders = []       # New subfolders to list once the current listing is done
+        self.scan_results = None        # Folders found by the background walker
+        self.scan_stop = None           # Event that stops the walker
+        self.scan_job = None
+        self.recovered_renames = 0
+        self.rename_poll_job = None
+        self.display_order = []         # Fixed order of images (paths relative to image_dir)
+        self.filename_map = {}          # Maps display indexes to current paths
         self.current_index = 0
         self.image_dir = ""
         self.names = []
         self.original_names = []
         self.default_dir = ""
-        self.used_names = set()
-        self.name_buttons = {}          # Dictionary to store references to buttons
+        self.name_set = set()
+        self.used_names = set()         # Names used in the current image's folder
+        self.current_dir = None         # Folder that used_names was found for
+        
+        # Preview prefetch settings (overridden by config.ini)
+        self.prefetch_workers = 2
+        self.prefetch_ahead = 3
+        self.prefetch_behind = 1
+        self.preview_cache_entries = 12
+        self.preview_cache_mb = 256
+        self.preview_quality = "fast"   # "fast" (reduced decode) or "exact"
+        self.resize_delay_ms = 150
+        self.preview_memory_mb = 512    # Most memory one image decode may use
+        self.progressive_preview = True # Show the EXIF thumbnail while decoding
+        self.name_rows = 5              # Rows of name buttons shown at once
+        self.disk_cache_mb = 512        # 0 disables the persistent preview cache
+        self.disk_cache_dir = app_data_dir()
+        self.show_filmstrip = True
+        self.thumbnail_workers = 1
+        self.restore_last_directory = True
+        self.include_subfolders = False
+        self.watch_folders = True       # Follow changes made by other programs
+        self.watch_interval_ms = 2000   # How often folders are checked where inotify is missing
+        self.group_bursts = True        # Name near-identical shots together
+        self.burst_threshold = 6        # Hash bits two shots of one burst may differ in
+        self.check_images = False       # Check every file in worker processes after listing
+        self.check_workers = 0          # 0 uses all cores but one
+        self.export_dir = ""            # Where renamed images are exported; empty turns exporting off
+        self.export_sizes = "web 1600x1600 jpeg, report 800x800 jpeg"
+        self.export_quality = 85
+        self.export_workers = 0         # 0 uses all cores but one
+        self.export_on_rename = True    # Export each image as its rename lands
+        self.log_startup_timing = log_startup_timing
+        self.show_latency_overlay = False
+        
+        # --profile records every timed stage for a Chrome trace file
+        self.profile = profile
+        if profile:
+            timings.start_trace()
+        self.overlay_job = None
+        
+        # Time to first paint and first image, measured from process start
+        self.startup_timer = StartupTimer(PROCESS_START)
+        
+        # Render state used to rescale the current image on window resize
+        self.source_image = None        # Decoded source for the current image
+        self.source_path = None
+        self.rendered_box = None        # Box the displayed preview was fitted to
+        self.resize_job = None          # Pending debounced resize render
+        self.full_preview = None        # (path, box) awaited to replace a quick preview
+        self.full_preview_job = None
+        
+        # Created in finish_startup, once the window has been drawn
+        self.preview_cache = None
+        self.disk_cache = None
+        self.prefetcher = None
+        self.thumbnailer = None
+        self.filmstrip = None
+        self.burst_finder = None
+        self.bursts = {}                # Maps display indexes to the indexes of their burst
+        self.burst_job = None
+        self.integrity_checker = None
+        self.image_info = {}            # Maps display indexes to check_image results
+        self.check_job = None
+        self.export_job = None
+        self.export_poll_job = None
+        self.export_counts = None       # Totals of a running "Export Renamed" batch
         
         # Load configuration
         self.load_config()
@@ -29,9 +130,108 @@ class ImageRenamerApp:
         # Create GUI elements
         self.create_widgets()
         
+        # Rescale the image when the image area is resized
+        self.main_frame.bind("<Configure>", self.on_resize)
+        
+        # Stop the prefetch workers when the window is closed
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        
+        # Everything else waits until the window is on screen
+        self.root.bind("<Expose>", self.on_first_paint, add="+")
+        self.root.after_idle(self.finish_startup)
+        
+    def on_first_paint(self, event):
+        """Record when the window was first drawn"""
+        self.startup_timer.mark("first_paint")
+        self.root.unbind("<Expose>")
+    
+    def finish_startup(self):
+        """Set up the image pipeline, name list and last folder after first paint"""
+        # Make sure the window is drawn before doing the slow part
+        self.root.update_idletasks()
+        
+        from bursts import BurstFinder
+        from filmstrip import Filmstrip
+        from integrity import IntegrityChecker
+        from previews import PreviewCache, Prefetcher
+        
+        # Background decoder and cache for the images around the current one
+        self.preview_cache = PreviewCache(self.preview_cache_entries,
+                                          self.preview_cache_mb * 1024 * 1024)
+        self.disk_cache = self.open_disk_cache()
+        self.prefetcher = Prefetcher(self.preview_cache, self.prefetch_workers,
+                                     self.preview_quality, self.disk_cache,
+                                     self.preview_memory_mb * 1024 * 1024)
+        
+        # Separate workers for filmstrip thumbnails so they never delay the main image
+        self.thumbnailer = Prefetcher(PreviewCache(2000, 64 * 1024 * 1024), self.thumbnail_workers,
+                                      "fast", self.disk_cache, self.preview_memory_mb * 1024 * 1024)
+        
+        # Hashes every image of a session to find bursts of similar shots
+        self.burst_finder = BurstFinder(self.burst_threshold,
+                                        max_bytes=self.preview_memory_mb * 1024 * 1024)
+        
+        # Finds damaged files, and slow ones to prefetch early, before they are reached
+        if self.check_images:
+            self.integrity_checker = IntegrityChecker(self.check_workers,
+                                                      self.preview_memory_mb * 1024 * 1024)
+        
+        # Derived sizes of renamed images, made in worker processes
+        if self.export_dir:
+            from export import ExportJob, parse_export_sizes
+            try:
+                self.export_job = ExportJob(parse_export_sizes(self.export_sizes), self.export_quality,
+                                            self.export_workers, self.preview_memory_mb * 1024 * 1024)
+            except ValueError as e:
+                messagebox.showerror("Error", f"Exporting is turned off: {str(e)}")
+                self.export_btn.config(state=tk.DISABLED)
+        
+        # Thumbnail strip for jumping to any image
+        if self.show_filmstrip:
+            self.filmstrip = Filmstrip(self.root, self.thumbnailer, self.get_image_path,
+                                       self.get_image_state, self.go_to_image)
+            self.filmstrip.pack(fill=tk.X, padx=10, after=self.filename_frame)
+        
         # Try to automatically load the namelist
         self.auto_load_namelist()
+        self.startup_timer.mark("ready")
         
+        # Reopen the last folder without blocking the window
+        if self.restore_last_directory and not self.image_dir:
+            self.reopen_last_directory()
+        
+    @staticmethod
+    def last_session_path():
+        return os.path.join(app_data_dir(), 'last_session.json')
+    
+    def save_last_directory(self):
+        """Remember the current session's folders for the next start"""
+        try:
+            os.makedirs(app_data_dir(), exist_ok=True)
+            with open(self.last_session_path(), 'w', encoding='utf-8') as file:
+                json.dump({"directory": self.image_dir, "roots": self.roots,
+                           "include_subfolders": self.subfolders_var.get()}, file)
+        except OSError as e:
+            print(f"Error saving last directory: {str(e)}")
+
+    def reopen_last_directory(self):
+        """Start a session on the last used folders; they are listed in the background"""
+        try:
+            with open(self.last_session_path(), 'r', encoding='utf-8') as file:
+                session = json.load(file)
+        except (OSError, ValueError):
+            return
+        roots = session.get("roots") or [session.get("directory")]
+        if not all(roots):
+            return
+
+        missing = [root for root in roots if not os.path.isdir(root)]
+        if missing:
+            self.status_label.config(text=f"Could not reopen {missing[0]}: folder not found")
+            return
+        self.subfolders_var.set(session.get("include_subfolders", self.subfolders_var.get()))
+        self.start_session(roots)
+
     def load_config(self):
         """Load configuration from config.ini file"""
         # Get the directory of the script or executable
@@ -42,6 +242,7 @@ class ImageRenamerApp:
             # If running as script
             app_dir = os.path.dirname(os.path.abspath(__file__))
             
+        self.namelist_path = os.path.join(app_dir, 'namelist.txt')
         config_path = os.path.join(app_dir, 'config.ini')
         
         if os.path.exists(config_path):
@@ -61,10 +262,55 @@ class ImageRenamerApp:
                         self.namelist_path = os.path.join(app_dir, 'namelist.txt')
                 else:
                     self.namelist_path = os.path.join(app_dir, 'namelist.txt')
+                    
+                if 'Settings' in config:
+                    settings = config['Settings']
+                    self.prefetch_workers = settings.getint('prefetch_workers', self.prefetch_workers)
+                    self.prefetch_ahead = settings.getint('prefetch_ahead', self.prefetch_ahead)
+                    self.prefetch_behind = settings.getint('prefetch_behind', self.prefetch_behind)
+                    self.preview_cache_entries = settings.getint('preview_cache_entries', self.preview_cache_entries)
+                    self.preview_cache_mb = settings.getint('preview_cache_mb', self.preview_cache_mb)
+                    self.preview_quality = settings.get('preview_quality', self.preview_quality).strip().lower()
+                    self.resize_delay_ms = settings.getint('resize_delay_ms', self.resize_delay_ms)
+                    self.preview_memory_mb = settings.getint('preview_memory_mb', self.preview_memory_mb)
+                    self.progressive_preview = settings.getboolean('progressive_preview', self.progressive_preview)
+                    self.name_rows = settings.getint('name_rows', self.name_rows)
+                    self.disk_cache_mb = settings.getint('disk_cache_mb', self.disk_cache_mb)
+                    self.disk_cache_dir = settings.get('disk_cache_dir', '').strip() or self.disk_cache_dir
+                    self.show_filmstrip = settings.getboolean('show_filmstrip', self.show_filmstrip)
+                    self.thumbnail_workers = settings.getint('thumbnail_workers', self.thumbnail_workers)
+                    self.restore_last_directory = settings.getboolean('restore_last_directory', self.restore_last_directory)
+                    self.include_subfolders = settings.getboolean('include_subfolders', self.include_subfolders)
+                    self.watch_folders = settings.getboolean('watch_folders', self.watch_folders)
+                    self.watch_interval_ms = settings.getint('watch_interval_ms', self.watch_interval_ms)
+                    self.group_bursts = settings.getboolean('group_bursts', self.group_bursts)
+                    self.burst_threshold = settings.getint('burst_threshold', self.burst_threshold)
+                    self.check_images = settings.getboolean('check_images', self.check_images)
+                    self.check_workers = settings.getint('check_workers', self.check_workers)
+                    self.export_dir = settings.get('export_dir', self.export_dir)
+                    self.export_sizes = settings.get('export_sizes', self.export_sizes)
+                    self.export_quality = settings.getint('export_quality', self.export_quality)
+                    self.export_workers = settings.getint('export_workers', self.export_workers)
+                    self.export_on_rename = settings.getboolean('export_on_rename', self.export_on_rename)
+                    self.log_startup_timing = self.log_startup_timing or settings.getboolean('log_startup_timing', False)
+                    self.show_latency_overlay = settings.getboolean('show_latency_overlay', self.show_latency_overlay)
             except Exception as e:
                 print(f"Error loading config: {str(e)}")
                 self.namelist_path = os.path.join(app_dir, 'namelist.txt')
                 
+    def open_disk_cache(self):
+        """Open the persistent preview cache, or return None if it is disabled"""
+        from previews import DiskPreviewCache
+        
+        if self.disk_cache_mb <= 0:
+            return None
+        try:
+            return DiskPreviewCache(os.path.join(self.disk_cache_dir, 'previews.sqlite'),
+                                    self.disk_cache_mb * 1024 * 1024)
+        except Exception as e:
+            print(f"Error opening preview cache: {str(e)}")
+            return None
+    
     def auto_load_namelist(self):
         """Try to automatically load namelist.txt from program directory"""
         if os.path.exists(self.namelist_path):
@@ -82,6 +328,16 @@ class ImageRenamerApp:
         select_btn = tk.Button(top_frame, text="Select Image Directory", command=self.select_directory)
         select_btn.pack(side=tk.LEFT, padx=5)
         
+        # Another folder for the same session
+        add_btn = tk.Button(top_frame, text="Add Folder", command=self.add_directory)
+        add_btn.pack(side=tk.LEFT, padx=5)
+
+        # Walk the whole tree under the chosen folders
+        self.subfolders_var = tk.BooleanVar(value=self.include_subfolders)
+        subfolders_check = tk.Checkbutton(top_frame, text="Include subfolders",
+                                          variable=self.subfolders_var, command=self.toggle_subfolders)
+        subfolders_check.pack(side=tk.LEFT, padx=5)
+
         # Display current directory
         self.dir_label = tk.Label(top_frame, text="No directory selected")
         self.dir_label.pack(side=tk.LEFT, padx=10)
@@ -119,132 +375,813 @@ class ImageRenamerApp:
         self.bottom_frame = tk.Frame(self.root)
         self.bottom_frame.pack(fill=tk.X, padx=10, pady=10)
         
-        # Frame for name buttons (will be populated dynamically)
-        self.name_buttons_frame = tk.Frame(self.bottom_frame)
-        self.name_buttons_frame.pack(fill=tk.X, pady=5)
+        # Name buttons with a filter box; only the visible rows exist
+        self.name_panel = NamePanel(self.bottom_frame, self.rename_image, rows=self.name_rows)
+        self.name_panel.pack(fill=tk.X, pady=5)
+        
+        # Typing anywhere starts filtering the names
+        self.root.bind("<Key>", self.name_panel.type_ahead, add="+")
+        
+        actions_frame = tk.Frame(self.bottom_frame)
+        actions_frame.pack(pady=10)
         
         # Skip button
-        self.skip_btn = tk.Button(self.bottom_frame, text="Don't Rename", command=self.skip_image)
-        self.skip_btn.pack(pady=10)
+        self.skip_btn = tk.Button(actions_frame, text="Don't Rename", command=self.skip_image)
+        self.skip_btn.pack(side=tk.LEFT, padx=5)
+        
+        # Undo button (also Ctrl+Z)
+        self.undo_btn = tk.Button(actions_frame, text="Undo Rename", command=self.undo_rename,
+                                  state=tk.DISABLED)
+        self.undo_btn.pack(side=tk.LEFT, padx=5)
+        self.root.bind("<Control-z>", self.undo_rename)
+        
+        # One name for a whole burst of near-identical shots
+        self.bursts_var = tk.BooleanVar(value=self.group_bursts)
+        bursts_check = tk.Checkbutton(actions_frame, text="Name bursts together",
+                                      variable=self.bursts_var, command=self.toggle_bursts)
+        bursts_check.pack(side=tk.LEFT, padx=5)
+        
+        # Export every renamed image to the sizes in config.ini
+        if self.export_dir:
+            self.export_btn = tk.Button(actions_frame, text="Export Renamed", command=self.export_renamed)
+            self.export_btn.pack(side=tk.LEFT, padx=5)
         
         # Status label
         self.status_label = tk.Label(self.root, text="Ready. Select a directory and load a name list to begin.")
         self.status_label.pack(side=tk.BOTTOM, pady=5)
+        
+        # F12 shows or hides the stage latencies under the status text
+        self.root.bind("<F12>", self.toggle_latency_overlay)
+        if self.show_latency_overlay:
+            self.root.after(1000, self.update_latency_overlay)
+    
+    def toggle_latency_overlay(self, event=None):
+        """Show or hide the latency overlay in the status bar"""
+        self.show_latency_overlay = not self.show_latency_overlay
+        self.update_latency_overlay()
+    
+    def update_latency_overlay(self):
+        """Show recent p50/p90 stage latencies on a second status line"""
+        if self.overlay_job is not None:
+            self.root.after_cancel(self.overlay_job)
+            self.overlay_job = None
+            
+        # Status messages are one line; the overlay is everything after it
+        status = self.status_label.cget("text").split("\n")[0]
+        if self.show_latency_overlay:
+            status += "\n" + timings.summary(OVERLAY_STAGES)
+            self.overlay_job = self.root.after(1000, self.update_latency_overlay)
+        self.status_label.config(text=status)
     
     def select_directory(self):
         """Open dialog to select directory containing images"""
         initial_dir = self.default_dir if os.path.exists(self.default_dir) else os.path.expanduser("~")
-        
-        self.image_dir = filedialog.askdirectory(
+
+        directory = filedialog.askdirectory(
             title="Select Directory with Images",
             initialdir=initial_dir
         )
-        
-        if self.image_dir:
-            self.dir_label.config(text=self.image_dir)
-            self.load_images()
-    
-    def refresh_directory(self):
-        """Refresh the list of image files from the directory"""
-        if not self.image_dir:
-            return False
-            
-        # Get the extensions from the original loading function
-        image_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff')
-        
-        # Refresh the list of files
+
+        if directory:
+            self.start_session([directory])
+
+    def add_directory(self):
+        """Add another folder to the current session"""
+        if not self.roots:
+            self.select_directory()
+            return
+
+        directory = filedialog.askdirectory(title="Add Another Directory with Images",
+                                            initialdir=self.image_dir)
+        if directory:
+            self.start_session(self.roots + [directory])
+
+    def toggle_subfolders(self):
+        """List the session again with or without subfolders"""
+        if self.roots:
+            self.start_session(self.roots)
+
+    def start_session(self, roots):
+        """Start a session on one or more folders
+
+        A session of the same folders that was saved earlier is resumed
+        where it was left. Otherwise the folders are listed on a background
+        thread and poll_scan adds their images to display_order as they are
+        found, so the first image appears while the rest of the tree is
+        still being listed. Paths in the session are relative to
+        image_dir, the folders' common parent.
+        """
         try:
-            self.image_files = [f for f in os.listdir(self.image_dir) 
-                               if os.path.isfile(os.path.join(self.image_dir, f)) 
-                               and f.lower().endswith(image_extensions)]
-            
-            # Update filename map with current filenames
-            self.update_filename_map()
-            
-            return True
-        except Exception as e:
-            print(f"Error refreshing directory: {str(e)}")
-            return False
-    
-    def update_filename_map(self):
-        """Update the filename map to reflect current filenames while preserving order"""
-        if not self.display_order:
+            base = session_base(roots)
+        except ValueError:
+            messagebox.showerror("Error", "The folders of one session must be on the same drive.")
             return
             
-        # Build a set of files in the directory for faster lookup
-        files_set = set(self.image_files)
-        
-        # Update the filename map with current files
-        for i, old_filename in enumerate(self.display_order):
-            # If the old filename exists in the directory, keep it
-            if old_filename in files_set:
-                self.filename_map[i] = old_filename
-            # Otherwise, look for renamed versions in the directory
-            elif i in self.filename_map and self.filename_map[i] in files_set:
-                # Current mapping is still valid
-                continue
-            else:
-                # If we can't find the file, mark it as None
-                self.filename_map[i] = None
-    
-    def load_images(self):
-        """Load all image files from the selected directory"""
-        image_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff')
-        self.image_files = [f for f in os.listdir(self.image_dir) 
-                           if os.path.isfile(os.path.join(self.image_dir, f)) 
-                           and f.lower().endswith(image_extensions)]
-        
-        if not self.image_files:
-            messagebox.showinfo("No Images", "No image files found in the selected directory.")
+        # The new session replays its journal, which must not still be written
+        # to from this one; until the queued renames have landed, stay here
+        if self.rename_queue and not self.rename_queue.wait_idle(timeout=10):
+            messagebox.showwarning("Renames Still Running",
+                                   "Earlier renames are still being written to disk. "
+                                   "Open the folders again once they have finished.")
             return
+
+        self.stop_scan()
+        self.stop_bursts()
+        self.stop_checks()
+        self.stop_watching()
+        self.export_counts = None
         
-        # Save the original display order
-        self.display_order = self.image_files.copy()
-        
-        # Initialize the filename map
-        self.filename_map = {i: filename for i, filename in enumerate(self.display_order)}
-        
+        # The queued renames have landed; the saved session includes them
+        if self.rename_queue:
+            self.rename_queue.close(timeout=10)
+            for op in self.rename_queue.poll():
+                if op["status"] == "done":
+                    self.finish_rename(op)
+            self.save_session_state()
+
+        self.roots = list(roots)
+        self.image_dir = base
+        self.dir_label.config(text=base if len(roots) == 1 else f"{base} ({len(roots)} folders)")
+
+        # Start with an empty session; poll_scan fills it in
+        self.dir_indexes = {}
+        self.dir_entries = {}
+        self.display_order = []
+        self.filename_map = {}
         self.current_index = 0
-        
-        # Reset used names when loading new images
+        self.current_dir = None
         self.used_names = set()
-        
-        # Reset button appearances
+        self.recovered_renames = 0
+        self.last_rename_id = 0
         self.reset_button_appearances()
+
+        # Previews from a previous load may be out of date
+        self.preview_cache.clear()
+        if self.filmstrip:
+            self.filmstrip.set_count(0)
+
+        self.rename_queue = RenameQueue(base)
+        self.session_state = SessionState(state_path(base, '.session'))
+        self.expected_renames = {}
+        self.waiting_folders = []
+        if self.watch_folders:
+            self.watcher = create_watcher(base, self.watch_interval_ms / 1000)
+            self.watch_job = self.root.after(250, self.poll_watcher)
+        self.update_undo_button()
+        self.save_last_directory()
         
-        # Scan for existing filenames that match names in the list
-        self.scan_existing_names()
+        # The checkbox may change before the session is saved for the last time
+        recursive = self.subfolders_var.get()
+        self.session_recursive = recursive
+        if self.resume_session(recursive):
+            return
+        self.status_label.config(text=f"Looking for images in {base}...")
+        self.scan_in_background(roots, recursive, recover=True)
+
+    def scan_in_background(self, roots, recursive, recover=False):
+        """List folders on a background thread; poll_scan adds their images"""
+        results = queue.Queue()
+        stop = threading.Event()
+        rename_queue = self.rename_queue
+        base = self.image_dir
+        # Exports inside the session's folders are not part of the session
+        exclude = [self.export_root()] if self.export_job else []
+
+        def scan():
+            # Finish renames interrupted by a crash before listing anything
+            if recover:
+                try:
+                    results.put(("recovered", rename_queue.recover()))
+                except Exception as e:
+                    print(f"Error reading rename journal: {str(e)}")
+                    results.put(("recovered", []))
+            try:
+                for relative_dir, dir_index in walk_directories(base, roots, recursive, stop, exclude):
+                    results.put(("directory", relative_dir, dir_index))
+            except Exception as e:
+                print(f"Error listing folders: {str(e)}")
+            results.put(("done",))
+
+        self.scan_results = results
+        self.scan_stop = stop
+        threading.Thread(target=scan, name="scan-directories", daemon=True).start()
+        self.scan_job = self.root.after(10, self.poll_scan)
+
+    def stop_scan(self):
+        """Stop listing the folders of the current session"""
+        if self.scan_stop:
+            self.scan_stop.set()
+        if self.scan_job is not None:
+            self.root.after_cancel(self.scan_job)
+        self.scan_results = None
+        self.scan_stop = None
+        self.scan_job = None
+
+    def poll_scan(self):
+        """Add the folders listed so far by the background walker"""
+        self.scan_job = None
+        if self.scan_results is None:
+            return
+
+        found_before = len(self.display_order)
+        done = False
+
+        # Take what has arrived, but never hold up the window for long
+        deadline = time.perf_counter() + 0.02
+        while time.perf_counter() < deadline:
+            try:
+                message = self.scan_results.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == "recovered":
+                self.finish_recovery(message[1])
+            elif message[0] == "directory":
+                self.add_listing(message[1], message[2])
+            else:
+                done = True
+                break
+
+        if len(self.display_order) > found_before:
+            if self.filmstrip:
+                self.filmstrip.extend(len(self.display_order))
+            if not self.names:
+                self.status_label.config(text=f"Found {len(self.display_order)} images so far. "
+                                              "Load a name list to begin.")
+            elif self.current_index == found_before:
+                # First image, or the user was waiting at the end for more
+                self.display_current_image()
+            else:
+                self.update_nav_buttons()
+
+        if done:
+            self.finish_scan()
+        else:
+            self.scan_job = self.root.after(20, self.poll_scan)
+
+    def finish_recovery(self, recovered):
+        """Report renames from the last session that were finished on startup"""
+        failed = [op for op in recovered if op["status"] == "failed"]
+        if failed:
+            errors = "\n".join(f"{op['src']} -> {op['dst']}: {op['error']}" for op in failed)
+            messagebox.showwarning("Interrupted Renames",
+                                   f"Some renames from the last session could not be finished:\n{errors}")
+        self.recovered_renames = len(recovered) - len(failed)
         
-        status_text = f"Found {len(self.image_files)} images."
+        # The session now includes every rename in the journal
+        self.last_rename_id = max([self.last_rename_id] + [op["id"] for op in self.rename_queue.finished])
+        self.update_undo_button()
+
+    def add_listing(self, relative_dir, dir_index):
+        """Add the images of one listed folder to the end of the session"""
+        self.dir_indexes[relative_dir] = dir_index
+        if self.watcher:
+            self.watcher.watch(relative_dir, dir_index.mtime)
+        self.append_images(relative_dir, dir_index.images())
+
+    def append_images(self, relative_dir, filenames):
+        """Add images of a session folder to the end of display_order"""
+        indexes = self.dir_entries.setdefault(relative_dir, [])
+        for filename in filenames:
+            path = os.path.join(relative_dir, filename)
+            indexes.append(len(self.display_order))
+            self.filename_map[len(self.display_order)] = path
+            self.display_order.append(path)
+
+    def resume_session(self, recursive):
+        """Restore the saved session of the current folders; returns False if there is none
+
+        Only each folder's mtime is checked; folders that changed since the
+        session was saved are listed again and their files matched to the
+        saved order. New subfolders are listed in the background.
+        """
+        with timings.stage("resume"):
+            saved = self.session_state.restore(self.image_dir, self.roots, recursive)
+        if saved is None:
+            return False
+            
+        # Renames interrupted by a crash land before the folders are checked
+        try:
+            recovered = self.rename_queue.recover()
+        except Exception as e:
+            print(f"Error reading rename journal: {str(e)}")
+            recovered = []
+            
+        changed = []
+        new_folders = []
+        with timings.stage("resume"):
+            for directory, dir_index in saved["dir_indexes"].items():
+                try:
+                    if dir_index.revalidate():
+                        changed.append(directory)
+                except OSError:
+                    # A folder of the session is gone; list everything again
+                    return False
+            for directory in changed:
+                dir_index = saved["dir_indexes"][directory]
+                if recursive:
+                    new_folders += [os.path.join(dir_index.directory, name) for name in dir_index.subdirs
+                                    if not name.startswith(".")
+                                    and os.path.normpath(os.path.join(directory, name)) not in saved["dir_indexes"]]
+                
+        self.display_order = saved["display_order"]
+        self.filename_map = saved["filename_map"]
+        self.dir_indexes = saved["dir_indexes"]
+        self.dir_entries = {}
+        for index, path in enumerate(self.display_order):
+            self.dir_entries.setdefault(os.path.dirname(path), []).append(index)
+
+        # Follow the renames that reached the disk after the session was
+        # saved: ones replayed just now, and ones that landed after the save
+        self.last_rename_id = saved["last_rename"]
+        where = {path: index for index, path in self.filename_map.items() if path}
+        for op in self.rename_queue.finished:
+            if op["id"] > self.last_rename_id:
+                index = where.pop(op["src"], None)
+                if index is not None:
+                    self.filename_map[index] = op["dst"]
+                    where[op["dst"]] = index
+        if changed:
+            self.update_filename_map(changed)
+            
+        # Images that arrived while the app was closed go at the end
+        for directory in changed:
+            self.add_new_images(directory, self.dir_indexes[directory].images())
+        if self.watcher:
+            for directory, dir_index in self.dir_indexes.items():
+                self.watcher.watch(directory, dir_index.mtime)
+        self.current_index = min(max(saved["current_index"], 0), len(self.display_order) - 1)
         
-        if not self.names:
-            status_text += " Load a name list to begin."
-        else:
+        self.finish_recovery(recovered)
+        if self.filmstrip:
+            self.filmstrip.extend(len(self.display_order))
+        if self.names:
             self.display_current_image()
             
+        if new_folders:
+            self.status_label.config(text="Looking for images in new folders...")
+            self.scan_in_background(new_folders, recursive)
+        else:
+            self.finish_scan(resumed=True)
+        return True
+
+    def finish_scan(self, resumed=False):
+        """Report the session once every folder has been listed"""
+        self.scan_results = None
+        self.scan_stop = None
+        
+        # Subfolders created while the listing was running
+        if self.waiting_folders:
+            folders, self.waiting_folders = self.waiting_folders, []
+            self.scan_in_background(folders, True)
+            return
+
+        if not self.display_order:
+            messagebox.showinfo("No Images", "No image files found in the selected directory.")
+            return
+            
+        # Later sessions of these folders resume from here
+        self.save_session_state()
+
+        if resumed:
+            status_text = f"Resumed at image {self.current_index + 1} of {len(self.display_order)}"
+        else:
+            status_text = f"Found {len(self.display_order)} images"
+        if len(self.dir_indexes) > 1:
+            status_text += f" in {len(self.dir_indexes)} folders"
+        status_text += "."
+        if self.recovered_renames:
+            status_text += f" Finished {self.recovered_renames} renames interrupted last session."
+        if not self.names:
+            status_text += " Load a name list to begin."
         self.status_label.config(text=status_text)
-    
-    def scan_existing_names(self):
-        """Scan directory for filenames that match names in the list"""
-        if not self.image_dir or not self.names:
+        
+        self.start_checks(range(len(self.display_order)))
+        if self.bursts_var.get():
+            self.find_bursts()
+            
+        # Catch up on exports that were still queued when the app was last closed
+        if self.export_on_rename:
+            self.export_images(self.renamed_indexes())
+
+    def start_checks(self, indexes):
+        """Check the files at these display indexes in the background"""
+        if not self.integrity_checker:
+            return
+        items = [(i, self.get_image_path(i)) for i in indexes if self.filename_map.get(i)]
+        if not items:
             return
+        self.integrity_checker.check(items)
+        if self.check_job is None:
+            self.check_job = self.root.after(250, self.poll_checks)
+
+    def poll_checks(self):
+        """Pick up finished checks and mark damaged files"""
+        self.check_job = None
+        damaged = []
+        recheck = []
+        for index, info in self.integrity_checker.take():
+            # Renamed or replaced while it was being checked: check what is there now
+            path = self.get_image_path(index)
+            if info["path"] != path:
+                if path:
+                    recheck.append((index, path))
+                continue
+            # Could not be read just now; that says nothing about the file, so it stays unchecked
+            if info["io_error"]:
+                continue
+            self.image_info[index] = info
+            if info["error"]:
+                damaged.append(index)
+        if recheck:
+            self.integrity_checker.check(recheck)
+                
+        if self.filmstrip:
+            for index in damaged:
+                self.filmstrip.refresh(index)
+        if self.current_index in damaged:
+            self.update_filename_label()
             
-        # Get all files in the directory
-        all_files = os.listdir(self.image_dir)
+        if self.integrity_checker.is_running():
+            self.check_job = self.root.after(250, self.poll_checks)
+            return
+        total = sum(1 for info in self.image_info.values() if info["error"])
+        if total:
+            self.status_label.config(text=f"Found {total} damaged image files; they are marked in the filmstrip.")
+        # Slow files now known further ahead can be queued for prefetching
+        if self.display_order and self.current_index < len(self.display_order):
+            self.prefetch_neighbors()
+
+    def stop_checks(self):
+        """Forget the checks of the current session and stop running them"""
+        if self.integrity_checker:
+            self.integrity_checker.stop()
+        if self.check_job is not None:
+            self.root.after_cancel(self.check_job)
+            self.check_job = None
+        self.image_info = {}
+
+    def is_damaged(self, index):
+        """Whether the pre-scan found the file at a display index unreadable"""
+        info = self.image_info.get(index)
+        return bool(info and info["error"])
+
+    def find_bursts(self):
+        """Start looking for bursts of near-identical shots in the background"""
+        if not self.burst_finder or not self.display_order or self.scan_results is not None:
+            return
+            
+        # Hash the files under their current names; shots in different folders never group
+        indexes = [i for i in range(len(self.display_order)) if self.filename_map.get(i)]
+        paths = [self.get_image_path(i) for i in indexes]
+        folders = [os.path.dirname(self.display_order[i]) for i in indexes]
+        self.burst_finder.start(paths, folders)
         
-        # Check each name in our list
-        for name in self.original_names:
-            # Look for files that start with this name followed by an extension
-            for file in all_files:
-                file_base = os.path.splitext(file)[0]
-                # Check if file starts with name exactly, or name followed by underscore and digits
-                if file_base == name or (file_base.startswith(name + "_") and file_base[len(name)+1:].isdigit()):
-                    self.used_names.add(name)
-                    break
+        def poll():
+            self.burst_job = None
+            groups = self.burst_finder.result()
+            if groups is None:
+                if self.burst_finder.is_running():
+                    self.burst_job = self.root.after(250, poll)
+                elif self.burst_finder.error:
+                    self.status_label.config(text=f"Could not look for bursts: {self.burst_finder.error}")
+                return
+            self.bursts = {}
+            for group in groups:
+                members = tuple(indexes[position] for position in group)
+                for index in members:
+                    self.bursts[index] = members
+            if groups:
+                self.status_label.config(text=f"Found {len(groups)} bursts of similar images.")
+            self.update_filename_label()
+            
+        self.burst_job = self.root.after(250, poll)
+    
+    def stop_bursts(self):
+        """Forget the bursts of the current session and stop looking for them"""
+        if self.burst_finder:
+            self.burst_finder.stop()
+        if self.burst_job is not None:
+            self.root.after_cancel(self.burst_job)
+            self.burst_job = None
+        self.bursts = {}
+    
+    def toggle_bursts(self):
+        """Turn naming bursts together on or off"""
+        if self.bursts_var.get() and not self.bursts and self.burst_job is None:
+            self.find_bursts()
+        self.update_filename_label()
+    
+    def burst_members(self, index):
+        """Get the display indexes named together with index, starting with index
+
+        Only shots of its burst that have not been renamed yet (and are not
+        about to be) are included, so naming the rest of a burst after
+        renaming some of it by hand leaves those alone.
+        """
+        members = [index]
+        if not self.bursts_var.get():
+            return members
+        for other in self.bursts.get(index, ()):
+            if (other != index and self.filename_map.get(other) == self.display_order[other]
+                    and not self.rename_queue.pending_target(other)):
+                members.append(other)
+        return members
+    
+    def index_after(self, members):
+        """Get the first display index after the current one that is not in members"""
+        index = self.current_index + 1
+        while index in members:
+            index += 1
+        return index
+
+    def stop_watching(self):
+        """Stop following changes to the session's folders"""
+        if self.watcher:
+            self.watcher.close()
+            self.watcher = None
+        self.expected_renames = {}
+        if self.watch_job is not None:
+            self.root.after_cancel(self.watch_job)
+            self.watch_job = None
+
+    def poll_watcher(self):
+        """Apply the batch of changes the folder watcher reported since the last poll"""
+        self.watch_job = self.root.after(250, self.poll_watcher)
+        events = self.watcher.events()
+        if events:
+            with timings.stage("watch"):
+                self.apply_changes(events)
+
+    def expect_rename(self, old_path, new_path):
+        """Note a rename the app queued, so the watcher can tell it from outside changes"""
+        if not self.watcher:
+            return
+        self.expected_renames[old_path] = new_path
+        self.watcher.expect(os.path.dirname(old_path), os.path.basename(old_path),
+                            os.path.basename(new_path))
+    
+    def is_own_rename(self, old_path, new_path):
+        """Check whether a reported rename is one the app made itself, and forget it"""
+        # Follow chains: the polling watcher sees a->b->c as a->c
+        chain = []
+        path = old_path
+        while path in self.expected_renames and path not in chain:
+            chain.append(path)
+            path = self.expected_renames[path]
+            if path == new_path:
+                for source in chain:
+                    del self.expected_renames[source]
+                return True
+        return False
+
+    def apply_changes(self, events):
+        """Bring listings, filename_map and used names up to date with outside changes
+
+        Only the entries named in the events are updated; a folder is only
+        listed again when the watcher lost track of it. Renamed images keep
+        their place in the session under their new name, and new images
+        are added at the end.
+        """
+        where = {path: index for index, path in self.filename_map.items() if path}
+        pending = {op["dst"] for op in self.rename_queue.pending()}
+        changed = set()
+        rescan = set()
+        created = {}
+        new_folders = []
+        rewritten = []
         
+        for event in events:
+            kind, folder = event[0], event[1]
+            if kind == "rescan":
+                rescan.update(self.dir_indexes if folder is None else [folder])
+                continue
+            if folder not in self.dir_indexes:
+                continue
+            name = event[2]
+            path = os.path.join(folder, name)
+            
+            if kind == "renamed" and self.is_own_rename(path, os.path.join(event[3], event[4])):
+                # Already in the listing and, once it is finished, in filename_map
+                continue
+                
+            if kind == "modified":
+                self.prefetcher.forget(os.path.join(self.image_dir, path))
+                self.thumbnailer.forget(os.path.join(self.image_dir, path))
+                if path in where:
+                    # Checked again as written now
+                    self.image_info.pop(where[path], None)
+                    rewritten.append(where[path])
+                continue
+                
+            if kind in ("deleted", "renamed"):
+                self.dir_indexes[folder].remove(name.rstrip("/"))
+                changed.add(folder)
+                index = where.pop(path, None)
+                if kind == "renamed" and event[3] in self.dir_indexes:
+                    # Still in the session, possibly in another folder
+                    kind, folder, name = "created", event[3], event[4]
+                    new_path = os.path.join(folder, name)
+                    if index is not None:
+                        self.filename_map[index] = new_path
+                        where[new_path] = index
+                        self.preview_cache.rename(os.path.join(self.image_dir, path),
+                                                  os.path.join(self.image_dir, new_path))
+                    path = new_path
+                elif index is not None:
+                    self.filename_map[index] = None
+                    
+            if kind == "created":
+                self.dir_indexes[folder].add(name.rstrip("/"), is_dir=name.endswith("/"))
+                changed.add(folder)
+                if name.endswith("/"):
+                    new_folders.append(os.path.join(self.image_dir, path))
+                elif is_image_file(name) and path not in where and path not in pending:
+                    created.setdefault(folder, []).append(name)
+                    
+        # The listings are current again; no rescan is needed for these changes
+        for folder in changed - rescan:
+            self.dir_indexes[folder].touch()
+            
+        # Folders listed again here are recorded as stale by refresh_directory
+        stale = changed - rescan
+        for folder in rescan:
+            if os.path.isdir(os.path.join(self.image_dir, folder)):
+                self.refresh_directory(force=True, directory=folder)
+                created[folder] = self.dir_indexes[folder].images()
+            else:
+                # The folder itself was deleted or moved away
+                for index in self.dir_entries.get(folder, ()):
+                    self.filename_map[index] = None
+                stale.add(folder)
+                    
+        found_before = len(self.display_order)
+        for folder, names in created.items():
+            self.add_new_images(folder, names)
+        if self.scan_results is None:
+            # finish_scan checks every image once the listing is done
+            self.start_checks(rewritten + list(range(found_before, len(self.display_order))))
+            
+        # Resuming later lists the changed folders again
+        compact = False
+        for folder in stale:
+            compact |= self.session_state.record_stale(folder)
+        if compact or len(self.display_order) > found_before:
+            self.save_session_state()
+            
+        if new_folders and self.session_recursive:
+            if self.scan_results is None:
+                self.scan_in_background(new_folders, True)
+            else:
+                self.waiting_folders += new_folders
+                
+        self.show_changes(changed | rescan, found_before)
+
+    def add_new_images(self, directory, filenames):
+        """Append the images among filenames that are not in the session yet"""
+        known = {os.path.basename(self.filename_map[i]) for i in self.dir_entries.get(directory, ())
+                 if self.filename_map.get(i)}
+        known.update(os.path.basename(op["dst"]) for op in self.rename_queue.pending()
+                     if os.path.dirname(op["dst"]) == directory)
+        self.append_images(directory, [name for name in filenames if name not in known])
+
+    def show_changes(self, folders, found_before):
+        """Update the window after outside changes to folders"""
+        found = len(self.display_order) - found_before
+        if self.filmstrip:
+            if found:
+                self.filmstrip.extend(len(self.display_order))
+            self.filmstrip.refresh()
+        if not self.display_order:
+            return
+            
+        if self.current_dir in folders:
+            self.scan_existing_names()
+        if found and self.current_index == found_before and self.names:
+            # Waiting at the end for more images
+            self.display_current_image()
+        elif self.current_index < len(self.display_order):
+            if self.get_current_filename():
+                self.update_filename_label()
+            else:
+                self.filename_label.config(text="Current File Name is: None")
+                self.status_label.config(text="The current image was deleted or moved by another program.")
+            self.update_nav_buttons()
+        if found:
+            self.status_label.config(text=f"{found} new images added at the end.")
+
+    def save_session_state(self):
+        """Write a snapshot of the session for resuming it later"""
+        if not self.session_state or not self.display_order or self.scan_results is not None:
+            return
+        self.session_state.save(self.roots, self.session_recursive, self.display_order,
+                                self.filename_map, self.current_index, self.dir_indexes,
+                                self.last_rename_id)
+
+    def current_directory(self):
+        """Get the session folder of the current image ("" for image_dir itself)"""
+        if 0 <= self.current_index < len(self.display_order):
+            return os.path.dirname(self.display_order[self.current_index])
+        return None
+
+    def split_entry(self, path):
+        """Split a session path into its folder's listing and its filename"""
+        directory, filename = os.path.split(path)
+        return self.dir_indexes[directory], filename
+
+    def refresh_directory(self, force=False, directory=None):
+        """Refresh folder listings from disk
+
+        Refreshes directory, or by default the current image's folder (every
+        folder of the session if force is set). A folder is only listed
+        again if its modification time shows that it changed since the
+        last listing, or if force is set.
+        """
+        if not self.image_dir or not self.dir_indexes:
+            return False
+
+        if directory is not None:
+            directories = [directory]
+        elif force:
+            directories = list(self.dir_indexes)
+        else:
+            directories = [self.current_directory()]
+
+        try:
+            changed = []
+            for name in directories:
+                dir_index = self.dir_indexes.get(name)
+                if dir_index is None:
+                    continue
+                if force:
+                    dir_index.scan()
+                    changed.append(name)
+                elif dir_index.revalidate():
+                    changed.append(name)
+            if not changed:
+                return True
+
+            # Update filename map with current filenames
+            self.update_filename_map(changed)
+            for name in changed:
+                if self.session_state.record_stale(name):
+                    self.save_session_state()
+
+            # Names reserved by queued renames are taken even if not on disk yet
+            pending = self.rename_queue.pending()
+            for op in pending:
+                name, source = os.path.split(op["src"])
+                if name in changed:
+                    self.dir_indexes[name].remove(source)
+                    self.dir_indexes[name].add(os.path.basename(op["dst"]))
+                    
+            # The new listing has our finished renames; a folder the watcher could
+            # not watch would otherwise keep their entries for the whole session
+            queued = {op["src"] for op in pending}
+            for path in [path for path in self.expected_renames
+                         if os.path.dirname(path) in changed and path not in queued]:
+                del self.expected_renames[path]
+
+            return True
+        except Exception as e:
+            print(f"Error refreshing directory: {str(e)}")
+            return False
+
+    def update_filename_map(self, directories=None):
+        """Update the filename map to reflect current filenames while preserving order"""
+        if not self.display_order:
+            return
+
+        # Update the filename map with current files
+        for directory in (list(self.dir_entries) if directories is None else directories):
+            dir_index = self.dir_indexes[directory]
+            for i in self.dir_entries.get(directory, ()):
+                # If the old filename exists in the directory, keep it
+                if os.path.basename(self.display_order[i]) in dir_index:
+                    self.filename_map[i] = self.display_order[i]
+                # Otherwise, look for renamed versions in the directory
+                elif self.filename_map.get(i) and os.path.basename(self.filename_map[i]) in dir_index:
+                    # Current mapping is still valid
+                    continue
+                else:
+                    # If we can't find the file, mark it as None
+                    self.filename_map[i] = None
+
+        if self.filmstrip:
+            self.filmstrip.refresh()
+
+    def scan_existing_names(self):
+        """Mark the names used by files in the current image's folder"""
+        directory = self.current_directory()
+        if not self.names or directory not in self.dir_indexes:
+            return
+        self.current_dir = directory
+
+        # A name is used if a file is called name or name_<digits>
+        self.used_names = self.dir_indexes[directory].name_index.used_names(self.original_names)
+
         # Update button appearances
         self.update_button_appearances()
-    
+
     def select_name_list(self):
         """Open dialog to select a name list file"""
         # Get the directory of the script or executable
@@ -267,10 +1204,10 @@ class ImageRenamerApp:
     def load_name_list_from_file(self, file_path):
         """Load a name list from a specific file path"""
         try:
-            with open(file_path, 'r') as file:
-                # Read names and strip whitespace
-                self.names = [line.strip() for line in file if line.strip()]
-                self.original_names = self.names.copy()
+            # Read names and strip whitespace
+            self.names = load_name_list(file_path)
+            self.original_names = self.names.copy()
+            self.name_set = set(self.original_names)
                 
             if not self.names:
                 messagebox.showwarning("Empty File", "The selected file doesn't contain any names.")
@@ -283,9 +1220,11 @@ class ImageRenamerApp:
             self.create_name_buttons()
             
             # If images are loaded, scan for existing name matches
-            if self.image_dir and self.image_files:
+            if self.display_order:
                 self.scan_existing_names()
                 self.display_current_image()
+                if self.filmstrip:
+                    self.filmstrip.refresh()
                 
             self.status_label.config(text=f"Loaded {len(self.names)} names.")
             return True
@@ -295,51 +1234,46 @@ class ImageRenamerApp:
             return False
     
     def create_name_buttons(self):
-        """Create all name buttons once and store references"""
-        # Clear existing buttons
-        for widget in self.name_buttons_frame.winfo_children():
-            widget.destroy()
-            
-        # Clear button references
-        self.name_buttons = {}
-        
-        # Create new buttons for each name
-        column = 0
-        row = 0
-        button_width = 20  # Increased button width
-        max_columns = 4    # Reduced columns to accommodate wider buttons
-        
-        # Sort names alphabetically
-        sorted_names = sorted(self.original_names)
-        
-        for name in sorted_names:
-            # Create a frame to hold each button to ensure it displays properly
-            btn_frame = tk.Frame(self.name_buttons_frame)
-            btn_frame.grid(row=row, column=column, padx=5, pady=5)
-            
-            # Create button
-            btn = tk.Button(btn_frame, text=name, width=button_width,
-                          command=lambda n=name: self.rename_image(n))
-            btn.pack(fill=tk.BOTH, expand=True)
-            
-            # Store reference to button
-            self.name_buttons[name] = btn
-            
-            column += 1
-            if column >= max_columns:
-                column = 0
-                row += 1
+        """Show the loaded name list in the name panel"""
+        self.name_panel.set_names(self.original_names)
                 
     def reset_button_appearances(self):
-        """Reset all buttons to default appearance"""
-        for name, btn in self.name_buttons.items():
-            btn.config(bg="SystemButtonFace", fg="black")  # Default colors
+        """Show every name as unused"""
+        self.name_panel.set_used(())
     
     def update_button_appearances(self):
-        """Update button appearances based on used names"""
-        for name in self.used_names:
-            if name in self.name_buttons:
-                self.name_buttons[name].config(bg="red", fg="white")
+        """Show the names in used_names as used"""
+        self.name_panel.set_used(self.used_names)
+    
+    def get_image_path(self, index):
+        """Get the current path of the image at a display index, or None"""
+        filename = self.filename_map.get(index)
+        return os.path.join(self.image_dir, filename) if filename else None
+    
+    def get_image_state(self, index):
+        """Get the label and state (renamed, used, missing, damaged, normal) for a display index"""
+        path = self.filename_map.get(index)
+        if not path:
+            return "Missing", "missing"
+        filename = os.path.basename(path)
+        if self.is_damaged(index):
+            return filename, "damaged"
+        if path != self.display_order[index]:
+            return filename, "renamed"
+            
+        # Already carries one of the names from the list
+        base = os.path.splitext(filename)[0]
+        if base in self.name_set or split_suffix(base)[0] in self.name_set:
+            return filename, "used"
+        return filename, "normal"
+    
+    def go_to_image(self, index):
+        """Jump to the image at a display index"""
+        if not self.display_order or not 0 <= index < len(self.display_order):
+            return
+        self.refresh_directory()
+        self.current_index = index
+        self.display_current_image()
     
     def get_current_filename(self):
         """Get the current filename based on display order index"""
@@ -361,13 +1295,37 @@ class ImageRenamerApp:
             messagebox.showinfo("Error", f"Unable to find image at position {self.current_index + 1}.")
             return
         
+        # Names in use differ from folder to folder
+        if self.current_directory() != self.current_dir:
+            self.scan_existing_names()
+        
+        # A damaged mark may be out of date (the file was copied over again, say);
+        # the file is decoded as usual and checked again rather than skipped
+        if self.is_damaged(self.current_index):
+            del self.image_info[self.current_index]
+            self.start_checks([self.current_index])
+            if self.filmstrip:
+                self.filmstrip.refresh(self.current_index)
+        
         # Update filename label
-        self.filename_label.config(text=f"Current File Name is: {current_filename}")
+        self.update_filename_label()
         
-        # Display the current image
+        # Display the current image; a preview or thumbnail that failed before is tried again
         image_path = os.path.join(self.image_dir, current_filename)
+        self.prefetcher.retry(image_path)
+        self.thumbnailer.retry(image_path)
         self.display_image(image_path)
         
+        # Decode the neighbouring images in the background
+        self.prefetch_neighbors()
+        
+        # Reopening the folders later starts here
+        if self.session_state.record_position(self.current_index):
+            self.save_session_state()
+        
+        if self.filmstrip:
+            self.filmstrip.set_current(self.current_index)
+        
         # Update status
         self.status_label.config(
             text=f"Image {self.current_index + 1} of {len(self.display_order)}: {current_filename}"
@@ -376,6 +1334,19 @@ class ImageRenamerApp:
         # Update nav button states
         self.update_nav_buttons()
     
+    def update_filename_label(self):
+        """Show the current file name, and how many shots are named with it"""
+        current_filename = self.get_current_filename()
+        if not current_filename:
+            return
+        text = f"Current File Name is: {current_filename}"
+        if self.is_damaged(self.current_index):
+            text += "  (damaged file)"
+        together = len(self.burst_members(self.current_index))
+        if together > 1:
+            text += f"  (burst: names {together} similar images)"
+        self.filename_label.config(text=text)
+    
     def update_nav_buttons(self):
         """Update navigation button states based on current position"""
         # Enable/disable previous button
@@ -390,113 +1361,466 @@ class ImageRenamerApp:
         else:
             self.next_btn.config(state=tk.NORMAL)
     
+    def get_display_box(self):
+        """Get the (width, height) available for displaying the image"""
+        window_width = self.main_frame.winfo_width() - 100  # Account for nav buttons
+        window_height = self.main_frame.winfo_height() - 20
+        
+        if window_width <= 1 or window_height <= 1:  # Window not properly sized yet
+            window_width = 700  # Reduced to account for nav buttons
+            window_height = 500
+            
+        return window_width, window_height
+    
     def display_image(self, image_path):
         """Load and display an image in the GUI"""
-        try:
-            # Check if file exists first
-            if not os.path.exists(image_path):
-                self.image_label.config(image=None)
-                self.image_label.config(text=f"Error: File not found\n{image_path}")
-                return
-                
-            # Open the image file
-            img = Image.open(image_path)
+        # The decoded source of a previous image is no longer needed
+        if image_path != self.source_path:
+            self.source_image = None
+            self.source_path = None
             
-            # Calculate the resize ratio to fit the window
-            window_width = self.main_frame.winfo_width() - 100  # Account for nav buttons
-            window_height = self.main_frame.winfo_height() - 20
-            
-            if window_width <= 1 or window_height <= 1:  # Window not properly sized yet
-                window_width = 700  # Reduced to account for nav buttons
-                window_height = 500
-                
-            img_width, img_height = img.size
-            scale_width = window_width / img_width
-            scale_height = window_height / img_height
-            scale = min(scale_width, scale_height)
+        box = self.get_display_box()
+        self.full_preview = None
+        try:
+            with timings.stage("display"):
+                img = self.preview_cache.get((image_path, box))
+                if img is None and self.progressive_preview:
+                    # Show the EXIF thumbnail now; prefetch_neighbors queues
+                    # the full render first and poll_full_preview swaps it in
+                    from previews import load_quick_preview
+                    quick = load_quick_preview(image_path, box, self.preview_memory_mb * 1024 * 1024)
+                    if quick is not None:
+                        self.show_preview(quick, box)
+                        self.full_preview = (image_path, box)
+                        self.schedule_full_preview_poll()
+                        
+                if img is None and self.full_preview is None:
+                    # Use the prefetched preview if there is one, otherwise decode now
+                    img = self.prefetcher.get(image_path, box)
+                if img is not None:
+                    self.show_preview(img, box)
+        except Exception as e:
+            self.show_image_error(image_path, e)
             
-            # Resize the image
-            new_width = int(img_width * scale)
-            new_height = int(img_height * scale)
-            img = img.resize((new_width, new_height), Image.LANCZOS)
+        if "first_image" not in self.startup_timer.marks:
+            self.startup_timer.mark("first_image")
+            self.save_startup_timing()
+    
+    def schedule_full_preview_poll(self):
+        if self.full_preview_job is None:
+            self.full_preview_job = self.root.after(20, self.poll_full_preview)
+    
+    def poll_full_preview(self):
+        """Replace the quick preview with the full render once it is decoded"""
+        self.full_preview_job = None
+        if self.full_preview is None:
+            # Moved on to another image; its render is no longer wanted
+            return
             
-            # Convert to PhotoImage for display
+        image_path, box = self.full_preview
+        img = self.preview_cache.get((image_path, box))
+        if img is not None:
+            self.full_preview = None
+            self.show_preview(img, box)
+        elif self.prefetcher.failure(image_path, box):
+            self.full_preview = None
+            self.show_image_error(image_path, self.prefetcher.failure(image_path, box))
+        elif self.prefetcher.is_pending(image_path, box):
+            self.schedule_full_preview_poll()
+        else:
+            # The queued render was cancelled or evicted; finish it here
+            self.full_preview = None
+            try:
+                self.show_preview(self.prefetcher.get(image_path, box), box)
+            except Exception as e:
+                self.show_image_error(image_path, e)
+    
+    def save_startup_timing(self):
+        """Log this run's startup milestones if timing is enabled"""
+        if not self.log_startup_timing or self.startup_timer.saved:
+            return
+        print(f"Startup timing: {self.startup_timer.report()}")
+        self.startup_timer.save(os.path.join(app_data_dir(), 'startup_timing.jsonl'),
+                                frozen=bool(getattr(sys, 'frozen', False)))
+    
+    def show_preview(self, img, box):
+        """Show a resized preview in the image label"""
+        from PIL import ImageTk
+        
+        # Convert to PhotoImage for display
+        with timings.stage("photo"):
             photo = ImageTk.PhotoImage(img)
             self.image_label.config(image=photo)
-            self.image_label.image = photo  # Keep a reference
+        self.image_label.image = photo  # Keep a reference
+        self.rendered_box = box
+    
+    def show_image_error(self, image_path, error):
+        """Replace the image with an error message"""
+        from previews import PreviewTooLarge
+        
+        self.image_label.config(image=None)
+        self.rendered_box = None
+        if isinstance(error, FileNotFoundError):
+            self.image_label.config(text=f"Error: File not found\n{image_path}")
+        elif isinstance(error, PreviewTooLarge):
+            self.image_label.config(text=f"Image too large to preview\n{str(error)}")
+        else:
+            self.image_label.config(text=f"Error loading image: {str(error)}")
+    
+    def on_resize(self, event):
+        """Schedule a re-render once the image area stops changing size"""
+        # Configure events also fire for moves; only size changes matter
+        if self.get_display_box() == self.rendered_box:
+            return
+            
+        # Coalesce a burst of events (e.g. a window drag) into one render
+        if self.resize_job is not None:
+            self.root.after_cancel(self.resize_job)
+        self.resize_job = self.root.after(self.resize_delay_ms, self.render_resized)
+    
+    def render_resized(self):
+        """Rescale the current image to the new window size"""
+        self.resize_job = None
+        
+        current_file = self.get_current_filename()
+        if not current_file or self.current_index >= len(self.display_order):
+            return
+            
+        box = self.get_display_box()
+        if box == self.rendered_box:
+            return
             
+        from previews import fit_image, load_source
+        
+        image_path = os.path.join(self.image_dir, current_file)
+        try:
+            # Decode the source once, large enough for any window size
+            if self.source_path != image_path:
+                screen_box = (self.root.winfo_screenwidth(), self.root.winfo_screenheight())
+                self.source_image = load_source(image_path, screen_box, self.preview_quality,
+                                                self.preview_memory_mb * 1024 * 1024)
+                self.source_path = image_path
+                
+            img = fit_image(self.source_image, box)
+            self.preview_cache.put((image_path, box), img)
+            self.full_preview = None
+            self.show_preview(img, box)
         except Exception as e:
-            self.image_label.config(image=None)
-            self.image_label.config(text=f"Error loading image: {str(e)}")
+            self.show_image_error(image_path, e)
+            return
+            
+        # Previews prepared for the old size are no use any more
+        self.prefetch_neighbors()
+    
+    def prefetch_neighbors(self):
+        """Start decoding the images before and after the current one"""
+        # The current image comes first in case only its quick preview is shown
+        indexes = [self.current_index]
+        indexes += [self.current_index + offset for offset in range(1, self.prefetch_ahead + 1)]
+        indexes += [self.current_index - offset for offset in range(1, self.prefetch_behind + 1)]
+        
+        # Files the pre-scan found slow to decode are started further ahead
+        from integrity import EXPENSIVE_SECONDS
+        for offset in range(self.prefetch_ahead + 1, 3 * self.prefetch_ahead + 1):
+            info = self.image_info.get(self.current_index + offset)
+            if info and info["seconds"] >= EXPENSIVE_SECONDS:
+                indexes.append(self.current_index + offset)
+        
+        paths = []
+        for index in indexes:
+            if (0 <= index < len(self.display_order) and self.filename_map.get(index)
+                    and not self.is_damaged(index)):
+                paths.append(os.path.join(self.image_dir, self.filename_map[index]))
+        
+        self.prefetcher.prefetch(paths, self.get_display_box())
     
     def rename_image(self, name):
-        """Rename the current image with the selected name"""
+        """Rename the current image with the selected name
+        
+        The rename is written to the journal and done in the background,
+        so the next image is shown without waiting for the file system.
+        With "Name bursts together", the other shots of the current
+        image's burst get the same name (numbered name_1, name_2, ...)
+        and are skipped over.
+        """
         if not self.display_order or self.current_index >= len(self.display_order):
             return
             
-        # Get current filename
-        current_file = self.get_current_filename()
+        # Take in our own renames that have landed, so that the mtime change
+        # they caused is not mistaken for an outside one
+        if self.rename_poll_job is not None:
+            self.root.after_cancel(self.rename_poll_job)
+        self.poll_renames()
+        
+        # Catch changes made outside the app (one stat of the directory). While
+        # our own renames are still landing the mtime is bound to move; changes
+        # made meanwhile are caught by the watcher or the next rename after them.
+        if self.current_directory() not in {os.path.dirname(op["src"]) for op in self.rename_queue.pending()}:
+            self.refresh_directory()
+            
+        # Get current filename, or the name a queued rename will give it
+        current_file = (self.rename_queue.pending_target(self.current_index)
+                        or self.get_current_filename())
         if not current_file:
             messagebox.showerror("Error", "Could not find the current file.")
             return
+        
+        members = self.burst_members(self.current_index)
+        renames = []
+        try:
+            # Reserve the new names in each file's own folder, using name_N
+            # if the plain name is already taken there
+            with timings.stage("rename"):
+                for index in members:
+                    source = current_file if index == self.current_index else self.filename_map[index]
+                    dir_index, filename = self.split_entry(source)
+                    new_filename = plan_rename(dir_index, filename, name)
+                    renames.append((source, os.path.join(os.path.dirname(source), new_filename), index))
+                try:
+                    self.rename_queue.submit_batch(renames)
+                    for source, target, _ in renames:
+                        self.expect_rename(source, target)
+                except Exception:
+                    for directory in {os.path.dirname(source) for source, _, _ in renames}:
+                        self.refresh_directory(force=True, directory=directory)
+                    raise
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to rename file: {str(e)}")
+            return
             
-        file_ext = os.path.splitext(current_file)[1]
-        new_name = f"{name}{file_ext}"
+        # Mark the name as used
+        self.used_names.add(name)
         
-        source_path = os.path.join(self.image_dir, current_file)
-        dest_path = os.path.join(self.image_dir, new_name)
+        # Update the button appearance
+        self.name_panel.mark_used(name)
         
-        # Check if destination file already exists
-        if os.path.exists(dest_path):
-            # Add a number to make the filename unique
-            count = 1
-            while os.path.exists(os.path.join(self.image_dir, f"{name}_{count}{file_ext}")):
-                count += 1
-            new_name = f"{name}_{count}{file_ext}"
-            dest_path = os.path.join(self.image_dir, new_name)
+        self.update_undo_button()
+        self.schedule_rename_poll()
         
-        try:
-            # Rename the file
-            os.rename(source_path, dest_path)
+        # Go to the next image, past the rest of the burst
+        self.current_index = self.index_after(members)
+        self.show_next_image()
+    
+    def show_next_image(self):
+        """Display the image at current_index, or report that all are done"""
+        if self.current_index < len(self.display_order):
+            self.display_current_image()
+        elif self.scan_results is not None:
+            # poll_scan shows the next image as soon as one is found
+            self.status_label.config(text="Looking for more images...")
+        else:
+            messagebox.showinfo("Complete", "All images have been processed.")
+            self.status_label.config(text="Processing complete.")
+    
+    def undo_rename(self, event=None):
+        """Undo the most recent rename (a whole burst named together), going back to that image"""
+        if not self.rename_queue:
+            return
+        ops = self.rename_queue.pop_undo_batch()
+        if not ops:
+            self.status_label.config(text="Nothing to undo.")
+            return
+        
+        undone = [op for op in ops if self.undo_op(op)]
+        if not undone:
+            return
             
-            # Mark the name as used
-            self.used_names.add(name)
+        self.update_undo_button()
+        self.schedule_rename_poll()
+        
+        indexes = [op["index"] for op in undone if op["index"] is not None]
+        if indexes:
+            self.current_index = min(indexes)
             
-            # Update the button appearance
-            if name in self.name_buttons:
-                self.name_buttons[name].config(bg="red", fg="white")
+        # The undone name may no longer be used by any file
+        self.scan_existing_names()
+        if indexes:
+            self.display_current_image()
+        if len(undone) == 1:
+            self.status_label.config(text=f"Undoing rename: {undone[0]['dst']} -> {undone[0]['src']}")
+        else:
+            self.status_label.config(text=f"Undoing {len(undone)} renames of a burst")
+    
+    def undo_op(self, op):
+        """Queue the rename that reverts op; returns False if it cannot be undone"""
+        directory, dst = os.path.split(op["dst"])
+        src = os.path.basename(op["src"])
+        dir_index = self.dir_indexes.get(directory)
+        self.refresh_directory(directory=directory)
+        if dir_index is None or not dir_index.exists(dst):
+            messagebox.showerror("Undo", f"Cannot undo: '{op['dst']}' no longer exists.")
+            self.update_undo_button()
+            return False
+        if dir_index.exists(src):
+            messagebox.showerror("Undo", f"Cannot undo: another file is now named '{op['src']}'.")
+            self.rename_queue.restore_undo(op)
+            return False
+        
+        # Renames from an earlier session have no display index; look it up
+        if op["index"] is None:
+            op["index"] = next((i for i, filename in self.filename_map.items() if filename == op["dst"]), None)
             
-            # Update the filename map
-            self.filename_map[self.current_index] = new_name
+        try:
+            dir_index.remove(dst)
+            dir_index.add(src)
+            self.rename_queue.submit(op["dst"], op["src"], op["index"], undo_of=op)
+            self.expect_rename(op["dst"], op["src"])
+        except Exception as e:
+            self.refresh_directory(force=True, directory=directory)
+            self.rename_queue.restore_undo(op)
+            messagebox.showerror("Error", f"Failed to undo rename: {str(e)}")
+            return False
+        return True
+    
+    def update_undo_button(self):
+        """Enable the undo button when there is a rename to undo"""
+        can_undo = self.rename_queue is not None and self.rename_queue.can_undo()
+        self.undo_btn.config(state=tk.NORMAL if can_undo else tk.DISABLED)
+    
+    def schedule_rename_poll(self):
+        """Check for finished background renames shortly"""
+        if self.rename_poll_job is None:
+            self.rename_poll_job = self.root.after(100, self.poll_renames)
+    
+    def poll_renames(self):
+        """Apply the results of finished background renames"""
+        self.rename_poll_job = None
+        if not self.rename_queue:
+            return
             
-            # Refresh the directory to keep internal structures in sync
-            self.refresh_directory()
+        failed = []
+        for op in self.rename_queue.poll():
+            if op["status"] == "failed":
+                failed.append(op)
+            else:
+                self.finish_rename(op)
+        
+        if self.rename_queue.pending():
+            self.schedule_rename_poll()
             
-            # Go to next image
-            self.current_index += 1
+        for op in failed:
+            self.expected_renames.pop(op["src"], None)
+        if failed:
+            # Drop the names reserved for the failed renames
+            for directory in {os.path.dirname(op["src"]) for op in failed}:
+                self.refresh_directory(force=True, directory=directory)
+            self.scan_existing_names()
+            self.update_undo_button()
+            errors = "\n".join(f"{op['src']} -> {op['dst']}: {op['error']}" for op in failed)
+            messagebox.showerror("Error", f"Failed to rename file:\n{errors}")
+    
+    def finish_rename(self, op):
+        """Update the app after a background rename reached the disk"""
+        source_path = os.path.join(self.image_dir, op["src"])
+        dest_path = os.path.join(self.image_dir, op["dst"])
+        
+        # Keep cached previews under the new name
+        self.preview_cache.rename(source_path, dest_path)
+        self.thumbnailer.cache.rename(source_path, dest_path)
+        if self.source_path == source_path:
+            self.source_path = dest_path
+        if self.full_preview and self.full_preview[0] == source_path:
+            self.full_preview = (dest_path, self.full_preview[1])
+        
+        # Our own rename changed the directory's mtime
+        dir_index = self.dir_indexes.get(os.path.dirname(op["dst"]))
+        if dir_index:
+            dir_index.touch()
+        
+        index = op["index"]
+        if index is None or index >= len(self.display_order):
+            return
             
-            # Display next image or show completion message
-            if self.current_index < len(self.display_order):
-                self.display_current_image()
+        # Update the filename map
+        self.filename_map[index] = op["dst"]
+        self.last_rename_id = max(self.last_rename_id, op["id"])
+        if dir_index and self.session_state.record_rename(index, op["src"], op["dst"], dir_index.mtime,
+                                                          op["id"]):
+            self.save_session_state()
+        if self.filmstrip:
+            self.filmstrip.refresh(index)
+        if index == self.current_index:
+            self.update_filename_label()
+            
+        if self.export_job and self.export_on_rename:
+            if op["dst"] != self.display_order[index]:
+                # Exports made under the old name are moved rather than made again
+                self.export_job.export((index, False), dest_path, self.export_root(), op["dst"], op["src"])
             else:
-                messagebox.showinfo("Complete", "All images have been processed.")
-                self.status_label.config(text="Processing complete.")
-                
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to rename file: {str(e)}")
+                # Undone back to the original name, which is not exported
+                self.export_job.discard((index, False), self.export_root(), op["src"])
+            self.schedule_export_poll()
+    
+    def export_root(self):
+        """Get the export folder of the current session; relative paths start at the session folder"""
+        return os.path.join(self.image_dir, os.path.expanduser(self.export_dir))
+    
+    def renamed_indexes(self):
+        """Get the display indexes of images renamed in this session, in display order"""
+        return [i for i in range(len(self.display_order))
+                if self.filename_map.get(i) and self.filename_map[i] != self.display_order[i]]
+    
+    def export_images(self, indexes, batch=False):
+        """Queue exports of the images at these display indexes; up-to-date exports are skipped"""
+        if not self.export_job or not indexes:
+            return
+        for index in indexes:
+            self.export_job.export((index, batch), self.get_image_path(index), self.export_root(),
+                                   self.filename_map[index])
+        self.schedule_export_poll()
+    
+    def export_renamed(self):
+        """Export every renamed image of the session, reporting progress"""
+        if not self.export_job:
+            return
+        indexes = self.renamed_indexes()
+        if not indexes:
+            messagebox.showinfo("Export", "No images have been renamed yet.")
+            return
+        self.export_counts = {"images": len(indexes), "done": 0, "made": 0, "moved": 0, "current": 0,
+                              "failed": 0}
+        self.status_label.config(text=f"Exporting {len(indexes)} images to {self.export_root()}...")
+        self.export_images(indexes, batch=True)
+    
+    def schedule_export_poll(self):
+        if self.export_poll_job is None:
+            self.export_poll_job = self.root.after(500, self.poll_exports)
+    
+    def poll_exports(self):
+        """Report finished exports; failures are shown in the status line"""
+        self.export_poll_job = None
+        for (index, batch), result in self.export_job.take():
+            if "error" in result:
+                print(f"Error exporting {result['path']}: {result['error']}")
+                self.status_label.config(text=f"Could not export {result['path']}: {result['error']}")
+            if batch and self.export_counts is not None:
+                self.export_counts["done"] += 1
+                self.export_counts["failed"] += "error" in result
+                for key in ("made", "moved", "current"):
+                    self.export_counts[key] += result.get(key, 0)
+                    
+        counts = self.export_counts
+        if counts is not None and counts["done"] >= counts["images"]:
+            status_text = (f"Exported {counts['images']} images: {counts['made']} files made, "
+                           f"{counts['moved']} moved, {counts['current']} already up to date.")
+            if counts["failed"]:
+                status_text += f" {counts['failed']} images failed (see the console)."
+            self.status_label.config(text=status_text)
+            self.export_counts = None
+        elif counts is not None:
+            self.status_label.config(text=f"Exporting: {counts['done']} of {counts['images']} images...")
+            
+        if self.export_job.is_running():
+            self.schedule_export_poll()
     
     def skip_image(self):
         """Skip the current image without renaming"""
         if not self.display_order or self.current_index >= len(self.display_order):
             return
             
-        self.current_index += 1
-        
-        if self.current_index < len(self.display_order):
-            self.display_current_image()
-        else:
-            messagebox.showinfo("Complete", "All images have been processed.")
-            self.status_label.config(text="Processing complete.")
+        # The rest of a burst is skipped with it
+        self.current_index = self.index_after(self.burst_members(self.current_index))
+        self.show_next_image()
     
     def previous_image(self):
         """Go to the previous image"""
@@ -510,14 +1834,52 @@ class ImageRenamerApp:
         self.current_index -= 1
         self.display_current_image()
     
+    def on_close(self):
+        """Stop background work and close the window"""
+        self.stop_scan()
+        self.stop_bursts()
+        self.stop_watching()
+        if self.integrity_checker:
+            self.integrity_checker.shutdown()
+        
+        # Give queued renames a chance to land; the journal replays any that don't
+        if self.rename_queue:
+            self.rename_queue.close(timeout=10)
+            for op in self.rename_queue.poll():
+                if op["status"] == "done":
+                    self.finish_rename(op)
+            self.save_session_state()
+        if self.prefetcher:
+            self.prefetcher.shutdown()
+            self.thumbnailer.shutdown()
+        if self.disk_cache:
+            self.disk_cache.close()
+        # Unfinished exports are made when the folder is next opened or exported
+        if self.export_job:
+            self.export_job.shutdown()
+        self.save_startup_timing()
+        self.save_profile()
+        self.root.destroy()
+    
+    def save_profile(self):
+        """Write the --profile trace to the per-user data folder"""
+        if not self.profile:
+            return
+        trace_path = os.path.join(app_data_dir(), 'traces',
+                                  time.strftime('trace-%Y%m%d-%H%M%S.json'))
+        if timings.save_trace(trace_path, images=len(self.display_order),
+                              frozen=bool(getattr(sys, 'frozen', False))):
+            print(f"Profile trace written to {trace_path}")
+    
     def reset_session(self):
         """Reset the session to start over"""
         self.current_index = 0
         self.used_names = set()  # Clear used names
+        self.current_dir = None
         self.reset_button_appearances()
         
-        # Refresh directory contents
-        self.refresh_directory()
+        # Refresh the contents of every folder
+        self.refresh_directory(force=True)
         
         if self.image_dir and self.display_order:
             self.scan_existing_names()
@@ -525,20 +1887,17 @@ class ImageRenamerApp:
 
 # Main application
 if __name__ == "__main__":
+    # Lets the integrity check's worker processes start in the built executable
+    multiprocessing.freeze_support()
+    
     root = tk.Tk()
-    app = ImageRenamerApp(root)
+    
+    # --startup-timing prints and logs time to first paint and first image;
+    # --profile writes a Chrome trace of every timed stage on exit
+    app = ImageRenamerApp(root, log_startup_timing="--startup-timing" in sys.argv[1:],
+                          profile="--profile" in sys.argv[1:])
     
     # Set min window size
     root.minsize(800, 600)
     
-    # Add window resize event to redisplay image on resize
-    def on_resize(event):
-        if hasattr(app, 'current_index') and app.display_order and app.current_index < len(app.display_order):
-            current_file = app.get_current_filename()
-            if current_file:
-                image_path = os.path.join(app.image_dir, current_file)
-                app.display_image(image_path)
-    
-    root.bind("<Configure>", on_resize)
-    
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,176 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class StartupTimer:
+    """Records how long after process start each startup milestone happens
+
+    Milestones are marked once each ("first_paint", "first_image", ...);
+    later marks of the same name are ignored. save() appends the run to a
+    JSON-lines log so startup times can be compared across versions.
+    """
+
+    def __init__(self, start):
+        self.start = start              # time.perf_counter() at process start
+        self.marks = {}
+        self.saved = False
+
+    def mark(self, name):
+        """Record a milestone the first time it is reached"""
+        if name not in self.marks:
+            self.marks[name] = time.perf_counter() - self.start
+
+    def report(self):
+        """Describe the milestones reached so far in one line"""
+        return ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.marks.items())
+
+    def save(self, log_path, **details):
+        """Append this run's milestones to log_path (once per run)"""
+        if self.saved:
+            return
+        self.saved = True
+        record = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "marks_ms": {name: round(seconds * 1000, 1) for name, seconds in self.marks.items()}}
+        record.update(details)
+        try:
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            with open(log_path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(record) + "\n")
+        except OSError as e:
+            print(f"Error writing startup timing: {str(e)}")
+
+
+class StageTimings:
+    """Rolling latency histograms for the stages of the image pipeline
+
+    Each stage ("decode", "resize", "photo", "os_rename", ...) keeps its
+    last window durations, so percentiles follow what the app is doing
+    now rather than averaging over the whole session. Timing a stage is
+    one lock and a deque append, cheap enough to leave on all the time.
+
+    When tracing is started every timed stage is also kept as a Chrome
+    trace event ("ph": "X"), and save_trace() writes them in the JSON
+    format read by chrome://tracing and Perfetto.
+    """
+
+    # Upper bounds of the histogram buckets in milliseconds
+    BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self, window=500, max_trace_events=500000):
+        self.window = window
+        self.max_trace_events = max_trace_events
+        self._samples = {}              # Maps stage names to recent durations in seconds
+        self._counts = {}               # Maps stage names to the total number of samples
+        self._trace = None              # Chrome trace events while tracing
+        self._threads = {}              # Maps thread ids to names for the trace
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, **args):
+        """Time the body of a with block as one run of stage name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter() - start, args)
+
+    def record(self, name, start, duration, args=None):
+        """Add one run of a stage that began at perf_counter() time start"""
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.window)
+            samples.append(duration)
+            self._counts[name] = self._counts.get(name, 0) + 1
+            
+            if self._trace is not None and len(self._trace) < self.max_trace_events:
+                thread = threading.current_thread()
+                self._threads.setdefault(thread.ident, thread.name)
+                event = {"name": name, "ph": "X", "pid": os.getpid(), "tid": thread.ident,
+                         "ts": round((start - self._origin) * 1e6, 1),
+                         "dur": round(duration * 1e6, 1)}
+                if args:
+                    event["args"] = args
+                self._trace.append(event)
+
+    def percentiles(self, name, fractions=(0.5, 0.9, 0.99)):
+        """Get the given percentiles of a stage's recent durations in ms"""
+        with self._lock:
+            ordered = sorted(self._samples.get(name, ()))
+        if not ordered:
+            return None
+        return [ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+                for fraction in fractions]
+
+    def histogram(self, name):
+        """Count a stage's recent durations per bucket of BUCKETS_MS"""
+        counts = [0] * (len(self.BUCKETS_MS) + 1)
+        with self._lock:
+            samples = list(self._samples.get(name, ()))
+        for duration in samples:
+            ms = duration * 1000
+            counts[next((i for i, bound in enumerate(self.BUCKETS_MS) if ms <= bound),
+                        len(self.BUCKETS_MS))] += 1
+        return counts
+
+    def stages(self):
+        with self._lock:
+            return list(self._samples)
+
+    def summary(self, names=None):
+        """Describe the p50/p90 latency of stages in one line"""
+        parts = []
+        for name in names or self.stages():
+            values = self.percentiles(name, (0.5, 0.9))
+            if values:
+                parts.append(f"{name} {values[0]:.0f}/{values[1]:.0f}")
+        return "p50/p90 ms: " + ", ".join(parts) if parts else "No timings yet"
+
+    def snapshot(self):
+        """Get counts, percentiles and histograms of every stage as a dict"""
+        result = {}
+        for name in self.stages():
+            p50, p90, p99 = self.percentiles(name)
+            with self._lock:
+                count = self._counts[name]
+            result[name] = {"count": count, "p50_ms": round(p50, 2), "p90_ms": round(p90, 2),
+                            "p99_ms": round(p99, 2), "buckets_ms": list(self.BUCKETS_MS),
+                            "histogram": self.histogram(name)}
+        return result
+
+    @property
+    def tracing(self):
+        return self._trace is not None
+
+    def start_trace(self):
+        """Start keeping every timed stage as a trace event"""
+        with self._lock:
+            if self._trace is None:
+                self._trace = []
+
+    def save_trace(self, path, **metadata):
+        """Write the trace collected so far as Chrome trace JSON"""
+        with self._lock:
+            events = list(self._trace or ())
+            threads = dict(self._threads)
+        pid = os.getpid()
+        events += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                   for tid, name in threads.items()]
+        metadata["stages"] = self.snapshot()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms", "metadata": metadata}, file)
+            return True
+        except OSError as e:
+            print(f"Error writing trace: {str(e)}")
+            return False
+
+
+# Shared by the app, the preview workers and the rename worker
+timings = StageTimings()
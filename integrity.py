@@ -0,0 +1,80 @@
+import time
+
+from PIL import Image
+
+from previews import DEFAULT_MEMORY_LIMIT, PreviewTooLarge, decode_source
+from workers import ProcessJob
+
+# Box the check decodes to; about the size of a full-screen preview
+CHECK_BOX = (1024, 1024)
+
+# Files handed to a worker process at a time
+CHUNK_SIZE = 16
+
+# Files whose check took at least this long are prefetched earlier
+EXPENSIVE_SECONDS = 0.25
+
+
+def check_image(image_path, max_bytes=DEFAULT_MEMORY_LIMIT):
+    """Check that an image file can be opened and decoded
+
+    The header is read and verified, then the image is decoded to about
+    screen size the way a "fast" preview is, which reads the whole file,
+    so truncated and corrupt files fail here rather than when they are
+    shown. Returns a dict with the path, the image's size, format, how
+    long the decode took in seconds, and error (None for good files).
+    Images that are merely too large to preview are not errors; they get
+    too_large. A file the system could not read at all (moved away,
+    locked, a network share dropping out) says nothing about its
+    contents: it gets io_error instead of error, and is left unchecked.
+    """
+    info = {"path": image_path, "size": None, "format": None, "seconds": 0.0,
+            "error": None, "io_error": None, "too_large": False}
+    start = time.perf_counter()
+    try:
+        with Image.open(image_path) as img:
+            info["size"] = img.size
+            info["format"] = img.format
+            img.verify()
+
+        # verify() leaves the image unusable; decode from a fresh open
+        with Image.open(image_path) as img:
+            decode_source(img, CHECK_BOX, "fast", max_bytes)
+    except PreviewTooLarge:
+        info["too_large"] = True
+    except OSError as e:
+        # Pillow's decode errors are OSErrors too, but carry no errno
+        if e.errno is not None:
+            info["io_error"] = str(e)
+        else:
+            info["error"] = str(e) or type(e).__name__
+    except Exception as e:
+        info["error"] = str(e) or type(e).__name__
+    info["seconds"] = time.perf_counter() - start
+    return info
+
+
+def check_images(image_paths, max_bytes=DEFAULT_MEMORY_LIMIT):
+    """Worker process task: check a chunk of files"""
+    return [check_image(path, max_bytes) for path in image_paths]
+
+
+class IntegrityChecker(ProcessJob):
+    """Checks image files in a pool of worker processes, ahead of display
+
+    check() queues (key, path) pairs and take() returns (key, info) pairs
+    with info as from check_image. Each worker decodes one image at a
+    time, so it never holds more than max_bytes of pixels.
+    """
+
+    def __init__(self, workers=0, max_bytes=DEFAULT_MEMORY_LIMIT):
+        super().__init__(check_images, (max_bytes,), workers, CHUNK_SIZE, "integrity-check")
+
+    def check(self, items):
+        """Queue (key, path) pairs for checking"""
+        self.submit(items)
+
+    def crashed(self, path, error):
+        """A file that takes its worker process down with it is damaged"""
+        return {"path": path, "size": None, "format": None, "seconds": 0.0, "too_large": False,
+                "io_error": None, "error": f"Decoding it crashed the checking process ({error})"}
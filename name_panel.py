@@ -0,0 +1,234 @@
+import bisect
+import tkinter as tk
+
+
+class NameSearch:
+    """Search index over a name list for filtering as you type
+
+    Matches are ranked: names starting with the query first, then names
+    with a word starting with it, then names containing it, then names
+    containing its letters in order ("lvrm" finds "Living Room"). The two
+    prefix ranks are looked up by bisecting sorted keys; only the fuzzy
+    ranks scan the list.
+    """
+
+    def __init__(self, names):
+        self.names = sorted(names)
+        self._keys = [name.lower() for name in self.names]
+
+        # Sorted (key, position) pairs for names and for the rest of each
+        # name from every later word on ("room 101" in "living room 101")
+        self._prefixes = sorted((key, i) for i, key in enumerate(self._keys))
+        self._words = sorted((key[start:], i) for i, key in enumerate(self._keys)
+                             for start in range(1, len(key))
+                             if key[start - 1] in " _-" and key[start] not in " _-")
+
+    @staticmethod
+    def _prefix_matches(pairs, query):
+        start = bisect.bisect_left(pairs, (query,))
+        for key, i in pairs[start:]:
+            if not key.startswith(query):
+                break
+            yield i
+
+    def search(self, query):
+        """Return the names matching query, best matches first"""
+        query = query.strip().lower()
+        if not query:
+            return list(self.names)
+
+        seen = set()
+        ranked = []
+        for rank in (sorted(self._prefix_matches(self._prefixes, query)),
+                     sorted(self._prefix_matches(self._words, query)),
+                     (i for i, key in enumerate(self._keys) if query in key),
+                     (i for i, key in enumerate(self._keys) if self._subsequence(query, key))):
+            for i in rank:
+                if i not in seen:
+                    seen.add(i)
+                    ranked.append(self.names[i])
+        return ranked
+
+    @staticmethod
+    def _subsequence(query, key):
+        letters = iter(key)
+        return all(char in letters for char in query if char != " ")
+
+
+class NamePanel(tk.Frame):
+    """Grid of name buttons with a filter box, drawing only the visible rows
+
+    A fixed pool of rows x columns buttons is created once and relabelled
+    as the list scrolls or the filter changes, so a list of 1,500 names
+    costs the same as one of 15. Typing filters the list; Enter picks the
+    highlighted name, Up/Down move the highlight and Escape clears the
+    filter. on_pick(name) is called when a name is chosen.
+    """
+
+    def __init__(self, master, on_pick, rows=5, columns=4, button_width=20):
+        super().__init__(master)
+        self.on_pick = on_pick
+        self.rows = rows
+        self.columns = columns
+
+        self.index = NameSearch([])
+        self.matches = []               # Names passing the filter, best first
+        self.used = set()               # Names shown as used
+        self.offset = 0                 # First visible row of matches
+        self.selected = 0               # Position in matches of the highlighted name
+
+        # Filter box and match count
+        filter_frame = tk.Frame(self)
+        filter_frame.pack(fill=tk.X, pady=(0, 5))
+        tk.Label(filter_frame, text="Filter:").pack(side=tk.LEFT)
+        self.filter_var = tk.StringVar()
+        self.filter_entry = tk.Entry(filter_frame, textvariable=self.filter_var, width=30)
+        self.filter_entry.pack(side=tk.LEFT, padx=5)
+        self.count_label = tk.Label(filter_frame, text="")
+        self.count_label.pack(side=tk.LEFT, padx=5)
+        self.filter_var.trace_add("write", lambda *args: self.apply_filter())
+
+        self.filter_entry.bind("<Return>", self.pick_selected)
+        self.filter_entry.bind("<Escape>", lambda event: self.clear_filter())
+        self.filter_entry.bind("<Down>", lambda event: self.move_selection(1))
+        self.filter_entry.bind("<Up>", lambda event: self.move_selection(-1))
+
+        # Recycled button pool
+        grid_frame = tk.Frame(self)
+        grid_frame.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.buttons = []
+        for slot in range(rows * columns):
+            btn = tk.Button(grid_frame, width=button_width,
+                            command=lambda s=slot: self.pick_slot(s))
+            btn.grid(row=slot // columns, column=slot % columns, padx=5, pady=5)
+            btn.bind("<MouseWheel>", self.on_mousewheel)
+            btn.bind("<Button-4>", lambda event: self.yview("scroll", -1, "units"))
+            btn.bind("<Button-5>", lambda event: self.yview("scroll", 1, "units"))
+            self.buttons.append(btn)
+        self.button_names = [None] * len(self.buttons)
+
+        # Default colours of this platform's buttons
+        self.default_bg = self.buttons[0].cget("bg")
+        self.default_fg = self.buttons[0].cget("fg")
+
+        self.scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.redraw()
+
+    def set_names(self, names):
+        """Show a new name list, unfiltered"""
+        self.index = NameSearch(names)
+        self.used = set()
+        self.filter_var.set("")
+        self.apply_filter()
+
+    def set_used(self, names):
+        """Show exactly names as used"""
+        self.used = set(names)
+        self.redraw()
+
+    def mark_used(self, name):
+        """Show one more name as used, updating only its button"""
+        self.used.add(name)
+        if name in self.button_names:
+            self.draw_button(self.button_names.index(name))
+
+    def apply_filter(self):
+        """Refilter the list after the filter text changed"""
+        self.matches = self.index.search(self.filter_var.get())
+        self.offset = 0
+        self.selected = 0
+        total = len(self.index.names)
+        self.count_label.config(text=f"{len(self.matches)} of {total} names"
+                                if len(self.matches) != total else f"{total} names")
+        self.redraw()
+
+    def clear_filter(self):
+        self.filter_var.set("")
+
+    def type_ahead(self, event):
+        """Start filtering when a letter is typed anywhere in the window"""
+        if isinstance(event.widget, tk.Entry) or not event.char or not event.char.isprintable():
+            return
+        # Leave Ctrl/Alt shortcuts alone
+        if event.state & 0x4 or event.state & 0x20000:
+            return
+        self.filter_entry.focus_set()
+        self.filter_entry.insert(tk.END, event.char)
+        return "break"
+
+    def move_selection(self, step):
+        """Move the keyboard highlight and keep it in view"""
+        if not self.matches:
+            return "break"
+        self.selected = min(max(self.selected + step, 0), len(self.matches) - 1)
+        row = self.selected // self.columns
+        if row < self.offset:
+            self.offset = row
+        elif row >= self.offset + self.rows:
+            self.offset = row - self.rows + 1
+        self.redraw()
+        return "break"
+
+    def pick_selected(self, event=None):
+        """Enter: assign the highlighted name"""
+        if self.matches and self.filter_var.get():
+            self.pick(self.matches[self.selected])
+        return "break"
+
+    def pick_slot(self, slot):
+        name = self.button_names[slot]
+        if name is not None:
+            self.pick(name)
+
+    def pick(self, name):
+        # Ready for the next image
+        if self.filter_var.get():
+            self.clear_filter()
+        self.on_pick(name)
+
+    def max_offset(self):
+        total_rows = -(-len(self.matches) // self.columns)
+        return max(0, total_rows - self.rows)
+
+    def redraw(self):
+        """Relabel the button pool for the visible rows of matches"""
+        for slot in range(len(self.buttons)):
+            self.draw_button(slot)
+
+        # Update the scrollbar
+        total_rows = max(-(-len(self.matches) // self.columns), 1)
+        self.scrollbar.set(self.offset / total_rows, min(1.0, (self.offset + self.rows) / total_rows))
+
+    def draw_button(self, slot):
+        """Show the right name and colours on one pooled button"""
+        btn = self.buttons[slot]
+        position = self.offset * self.columns + slot
+        if position >= len(self.matches):
+            btn.config(text="", state=tk.DISABLED, bg=self.default_bg, relief=tk.FLAT)
+            self.button_names[slot] = None
+            return
+
+        name = self.matches[position]
+        self.button_names[slot] = name
+        if name in self.used:
+            bg, fg = "red", "white"
+        else:
+            bg, fg = self.default_bg, self.default_fg
+        highlighted = position == self.selected and bool(self.filter_var.get())
+        btn.config(text=name, state=tk.NORMAL, bg=bg, fg=fg,
+                   relief=tk.SUNKEN if highlighted else tk.RAISED)
+
+    def yview(self, *args):
+        """Scrollbar command: ("moveto", fraction) or ("scroll", n, "units"/"pages")"""
+        if args[0] == "moveto":
+            total_rows = -(-len(self.matches) // self.columns)
+            self.offset = int(float(args[1]) * total_rows)
+        elif args[0] == "scroll":
+            step = 1 if args[2] == "units" else self.rows
+            self.offset += int(args[1]) * step
+        self.offset = min(max(self.offset, 0), self.max_offset())
+        self.redraw()
+
+    def on_mousewheel(self, event):
+        self.yview("scroll", -1 if event.delta > 0 else 1, "units")
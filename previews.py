@@ -0,0 +1,611 @@
+import hashlib
+import io
+import math
+import os
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from instrumentation import timings
+
+
+def fit_size(img_size, box):
+    """Calculate the size that fits an image of img_size inside box"""
+    img_width, img_height = img_size
+    box_width, box_height = box
+    scale = min(box_width / img_width, box_height / img_height)
+    return max(1, int(img_width * scale)), max(1, int(img_height * scale))
+
+
+# Modes that Image.reduce can average without changing the colours
+REDUCIBLE_MODES = ("L", "LA", "RGB", "RGBA")
+
+# Pillow's decompression-bomb guard refuses big panoramas outright; the
+# memory limit in load_source replaces it with a limit on what is decoded
+Image.MAX_IMAGE_PIXELS = None
+
+# Most memory a single preview decode may use (preview_memory_mb in config.ini)
+DEFAULT_MEMORY_LIMIT = 512 * 1024 * 1024
+
+# Bits per pixel of the uncompressed layouts that can be decoded in bands
+RAW_BITS = {"L": 8, "LA": 16, "RGB": 24, "BGR": 24, "RGBA": 32, "RGBX": 32, "BGRA": 32, "BGRX": 32}
+
+
+class PreviewTooLarge(Exception):
+    """Raised when an image cannot be previewed within the memory limit"""
+
+
+def decoded_bytes(size, mode):
+    """Estimate the memory Pillow needs to hold an image of size and mode"""
+    if mode in ("1", "L", "P"):
+        pixel_bytes = 1
+    elif mode.startswith("I;16"):
+        pixel_bytes = 2
+    else:
+        pixel_bytes = 4     # Multi-band images use four bytes per pixel
+    return size[0] * size[1] * pixel_bytes
+
+
+def choose_page(img, box, max_bytes, exact=False):
+    """Seek a multi-page TIFF to the page best suited for a preview in box
+
+    Pyramidal TIFFs store the same picture at several resolutions. The
+    smallest one that still fills box is used (the largest one with
+    exact), as long as it fits in max_bytes; otherwise the largest page
+    that fits. Pages of a different shape are separate pictures and are
+    left alone.
+    """
+    if img.format != "TIFF" or getattr(img, "n_frames", 1) < 2:
+        return
+    full_width, full_height = img.size
+    target = fit_size(img.size, box)
+    
+    # Only reading the page headers here, not the pixels
+    pages = []
+    for frame in range(img.n_frames):
+        img.seek(frame)
+        width, height = img.size
+        if abs(width * full_height - height * full_width) > 0.02 * full_width * height:
+            continue
+        pages.append((width * height, frame, decoded_bytes(img.size, img.mode) <= max_bytes,
+                      width >= target[0] and height >= target[1]))
+    
+    fitting = [page for page in pages if page[2]]
+    big_enough = [page for page in fitting if page[3]]
+    if exact and fitting:
+        chosen = max(fitting)
+    elif big_enough:
+        chosen = min(big_enough)
+    elif fitting:
+        chosen = max(fitting)
+    else:
+        chosen = min(pages)
+    img.seek(chosen[1])
+
+
+def raw_layout(img):
+    """Get (offset, rawmode, stride, orientation) of an uncompressed image, or None"""
+    if len(img.tile) != 1 or img.mode not in REDUCIBLE_MODES:
+        return None
+    codec, extents, offset, args = img.tile[0]
+    if codec != "raw" or tuple(extents) != (0, 0) + img.size:
+        return None
+    if isinstance(args, str):
+        args = (args,)
+    rawmode, stride, orientation = (tuple(args) + (0, 1))[:3]
+    if rawmode not in RAW_BITS:
+        return None
+    return offset, rawmode, stride or (img.width * RAW_BITS[rawmode] + 7) // 8, orientation
+
+
+def load_in_bands(img, layout, factor, max_bytes):
+    """Decode an uncompressed image a band of rows at a time, shrinking each band
+
+    Only one band of full-resolution rows is in memory at any time, so
+    images far larger than max_bytes can still be previewed.
+    """
+    offset, rawmode, stride, orientation = layout
+    width, height = img.size
+    # A band's raw rows plus its decoded copy stay under half of max_bytes
+    rows = max_bytes // 4 // decoded_bytes((width, 1), img.mode)
+    rows = max(factor, rows // factor * factor)
+    result = Image.new(img.mode, (-(-width // factor), -(-height // factor)))
+    
+    for top in range(0, height, rows):
+        band_rows = min(rows, height - top)
+        # Bottom-up files (orientation -1, e.g. BMP) store the last row first
+        first_row = top if orientation >= 0 else height - top - band_rows
+        img.fp.seek(offset + first_row * stride)
+        data = img.fp.read(band_rows * stride)
+        if len(data) < band_rows * stride:
+            raise OSError("image file is truncated")
+        band = Image.frombuffer(img.mode, (width, band_rows), data, "raw", rawmode, stride, orientation)
+        result.paste(band.reduce(factor), (0, top // factor))
+        del band, data
+    return result
+
+
+# EXIF orientation values and the transposes that undo them
+ORIENTATION_TRANSPOSES = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def exif_orientation(img):
+    """Get the EXIF orientation of an opened image (1 if it has none)"""
+    try:
+        orientation = img.getexif().get(0x0112, 1)
+    except Exception:
+        return 1
+    return orientation if orientation in ORIENTATION_TRANSPOSES else 1
+
+
+def apply_orientation(img, orientation):
+    """Turn a decoded image the right way up"""
+    if orientation in ORIENTATION_TRANSPOSES:
+        return img.transpose(ORIENTATION_TRANSPOSES[orientation])
+    return img
+
+
+def stored_box(box, orientation):
+    """Get the box in the file's own pixel layout (rotated by 90 degrees for 5-8)"""
+    return (box[1], box[0]) if orientation >= 5 else box
+
+
+def exif_thumbnail(img, max_bytes=DEFAULT_MEMORY_LIMIT):
+    """Get the JPEG thumbnail embedded in an image's EXIF data, or None
+
+    Cameras and phones store a small JPEG in the second EXIF directory
+    (IFD1). Only the already-read header is parsed; the main image's
+    pixels are not decoded. A "thumbnail" too big to decode within
+    max_bytes is ignored.
+    """
+    exif = img.info.get("exif")
+    if not exif:
+        return None
+    tiff = exif[6:] if exif.startswith(b"Exif\x00\x00") else exif
+    try:
+        endian = {b"II": "<", b"MM": ">"}[tiff[:2]]
+        
+        # Skip over IFD0 to the offset of IFD1
+        ifd0 = struct.unpack_from(endian + "I", tiff, 4)[0]
+        count = struct.unpack_from(endian + "H", tiff, ifd0)[0]
+        ifd1 = struct.unpack_from(endian + "I", tiff, ifd0 + 2 + count * 12)[0]
+        if not ifd1:
+            return None
+            
+        tags = {}
+        count = struct.unpack_from(endian + "H", tiff, ifd1)[0]
+        for n in range(count):
+            tag, kind, _ = struct.unpack_from(endian + "HHI", tiff, ifd1 + 2 + n * 12)
+            value_format = endian + ("H" if kind == 3 else "I")
+            tags[tag] = struct.unpack_from(value_format, tiff, ifd1 + 2 + n * 12 + 8)[0]
+    except (KeyError, struct.error):
+        return None
+        
+    # JPEGInterchangeFormat and JPEGInterchangeFormatLength
+    offset, length = tags.get(0x0201), tags.get(0x0202)
+    if not offset or not length or offset + length > len(tiff):
+        return None
+    try:
+        thumbnail = Image.open(io.BytesIO(tiff[offset:offset + length]))
+        # Nothing else limits its size; the header can claim any dimensions
+        if decoded_bytes(thumbnail.size, thumbnail.mode) > max_bytes:
+            return None
+        thumbnail.load()
+        return thumbnail
+    except Exception:
+        return None
+
+
+def load_quick_preview(image_path, box, max_bytes=DEFAULT_MEMORY_LIMIT):
+    """Make a rough preview in a few milliseconds, or return None
+
+    Uses the EXIF thumbnail if the file has one, otherwise a JPEG decoded
+    at 1/8 scale. Other formats, and JPEGs too big to decode within
+    max_bytes even at 1/8 scale, have no cheap preview and return None.
+    """
+    with timings.stage("quick"):
+        with Image.open(image_path) as img:
+            orientation = exif_orientation(img)
+            quick = exif_thumbnail(img, max_bytes)
+            if quick is None:
+                if img.format != "JPEG":
+                    return None
+                img.draft(None, (max(1, img.width // 8), max(1, img.height // 8)))
+                if decoded_bytes(img.size, img.mode) > max_bytes:
+                    return None
+                img.load()
+                quick = img
+            quick = apply_orientation(quick, orientation)
+            return quick.resize(fit_size(quick.size, box), Image.BILINEAR)
+
+
+def load_source(image_path, box, quality="fast", max_bytes=DEFAULT_MEMORY_LIMIT):
+    """Open and decode an image file at a resolution suitable for box
+
+    With quality "fast" the decoder is asked for a downscaled image:
+    JPEGs are decoded with DCT scaling and other formats are shrunk by an
+    integer factor, so the result is only slightly larger than box.
+    "exact" decodes the full-resolution bitmap when it fits in max_bytes.
+    
+    The header is checked before any pixels are decoded. Multi-page TIFFs
+    use their best stored resolution, and uncompressed images too big
+    for max_bytes are decoded in bands; anything else that would not fit
+    raises PreviewTooLarge. The result is turned by its EXIF orientation.
+    """
+    with timings.stage("open"):
+        img = Image.open(image_path)
+    with img:
+        orientation = exif_orientation(img)
+        with timings.stage("decode"):
+            source = decode_source(img, stored_box(box, orientation), quality, max_bytes)
+        return apply_orientation(source, orientation)
+
+
+def decode_source(img, box, quality, max_bytes):
+    """Decode an opened image for load_source, within max_bytes"""
+    choose_page(img, box, max_bytes, exact=quality != "fast")
+    target = fit_size(img.size, box)
+    factor = 1
+    
+    if quality == "fast" or decoded_bytes(img.size, img.mode) > max_bytes:
+        # JPEG only: decode at 1/2, 1/4 or 1/8 scale, never below target
+        img.draft(None, target)
+        
+        # Other formats: cheap box-filter reduction down to about 2x target
+        factor = max(1, min(img.width // target[0], img.height // target[1]) // 2)
+        
+    needed = decoded_bytes(img.size, img.mode)
+    if needed > max_bytes:
+        layout = raw_layout(img)
+        if layout is None:
+            raise PreviewTooLarge(
+                f"{img.width} x {img.height} pixels needs about {math.ceil(needed / 2 ** 20)} MB to preview, "
+                f"more than the {max_bytes // 2 ** 20} MB preview memory limit (preview_memory_mb)")
+        # Shrink enough that the result uses at most a quarter of the limit
+        factor = max(factor, math.ceil(math.sqrt(needed / (max_bytes / 4))))
+        return load_in_bands(img, layout, factor, max_bytes)
+        
+    img.load()
+    if factor >= 2 and img.mode in REDUCIBLE_MODES:
+        return img.reduce(factor)
+    return img
+
+
+def fit_image(img, box):
+    """Resize a decoded image to fit inside box"""
+    with timings.stage("resize"):
+        return img.resize(fit_size(img.size, box), Image.LANCZOS)
+
+
+def load_preview(image_path, box, quality="fast", max_bytes=DEFAULT_MEMORY_LIMIT):
+    """Open an image file and resize it to fit inside box (width, height)"""
+    return fit_image(load_source(image_path, box, quality, max_bytes), box)
+
+
+def image_bytes(img):
+    """Approximate the memory used by a decoded image"""
+    return img.width * img.height * len(img.getbands())
+
+
+class PreviewCache:
+    """Thread-safe LRU cache of resized previews keyed by (path, box)
+
+    The cache is bounded both by the number of entries and by the
+    approximate number of bytes held by the decoded images.
+    """
+
+    def __init__(self, max_entries=12, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached preview for key, or None if not cached"""
+        with self._lock:
+            img = self._entries.get(key)
+            if img is not None:
+                self._entries.move_to_end(key)
+            return img
+
+    def put(self, key, img):
+        """Store a preview and evict the least recently used entries"""
+        size = image_bytes(img)
+        with self._lock:
+            if size > self.max_bytes:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= image_bytes(old)
+            self._entries[key] = img
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= image_bytes(evicted)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def rename(self, old_path, new_path):
+        """Re-key every preview of old_path after the file was renamed"""
+        if new_path == old_path:
+            return
+        with self._lock:
+            # Previews still held under the new name are of another file
+            self._discard(new_path)
+            for key in [k for k in self._entries if k[0] == old_path]:
+                self._entries[(new_path,) + key[1:]] = self._entries.pop(key)
+
+    def discard(self, path):
+        """Drop every preview of path"""
+        with self._lock:
+            self._discard(path)
+
+    def _discard(self, path):
+        for key in [k for k in self._entries if k[0] == path]:
+            self._bytes -= image_bytes(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+def file_mtime(image_path):
+    """Get a file's mtime in nanoseconds, or None if it cannot be read"""
+    try:
+        return os.stat(image_path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def file_fingerprint(image_path, head_bytes=65536):
+    """Identify a file's content cheaply: its size, mtime and first bytes
+
+    None of these change when a file is renamed, so previews keyed by the
+    fingerprint stay valid after rename_image.
+    """
+    st = os.stat(image_path)
+    digest = hashlib.sha1(f"{st.st_size}:{st.st_mtime_ns}:".encode())
+    with open(image_path, 'rb') as file:
+        digest.update(file.read(head_bytes))
+    return digest.hexdigest()
+
+
+class DiskPreviewCache:
+    """Persistent LRU cache of encoded previews in a single SQLite file
+
+    Entries are keyed by the file's content fingerprint plus the target box
+    and decode quality, and the least recently used entries are deleted
+    once the total size goes over max_bytes.
+    """
+
+    def __init__(self, db_path, max_bytes=512 * 1024 * 1024):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=5, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS previews ("
+                         "key TEXT PRIMARY KEY, data BLOB NOT NULL, "
+                         "size INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS previews_last_used ON previews (last_used)")
+        self._db.commit()
+        self._bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM previews").fetchone()[0]
+
+    # Bumped when the way previews are made changes (2: EXIF orientation applied)
+    FORMAT = 2
+
+    @classmethod
+    def make_key(cls, fingerprint, box, quality):
+        return f"{fingerprint}:{box[0]}x{box[1]}:{quality}:v{cls.FORMAT}"
+
+    def get(self, key):
+        """Return the cached preview for key as a loaded image, or None"""
+        with self._lock, timings.stage("disk_cache_read"):
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT data FROM previews WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE previews SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        img = Image.open(io.BytesIO(row[0]))
+        img.load()
+        return img
+
+    def put(self, key, img):
+        """Encode and store a preview, evicting old entries if over the cap"""
+        buffer = io.BytesIO()
+        if img.mode in ("RGB", "L"):
+            img.save(buffer, "JPEG", quality=90)
+        else:
+            img.save(buffer, "PNG")
+        data = buffer.getvalue()
+        if len(data) > self.max_bytes:
+            return
+        
+        with self._lock, timings.stage("disk_cache_write"):
+            if self._db is None:
+                return
+            row = self._db.execute("SELECT size FROM previews WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._bytes -= row[0]
+            self._db.execute("INSERT OR REPLACE INTO previews (key, data, size, last_used) "
+                             "VALUES (?, ?, ?, ?)", (key, data, len(data), time.time()))
+            self._bytes += len(data)
+            if self._bytes > self.max_bytes:
+                self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        """Delete least recently used entries until below 90% of the cap"""
+        target = self.max_bytes * 0.9
+        while self._bytes > target:
+            rows = self._db.execute("SELECT key, size FROM previews "
+                                    "ORDER BY last_used LIMIT 100").fetchall()
+            if not rows:
+                self._bytes = 0
+                break
+            for key, size in rows:
+                self._db.execute("DELETE FROM previews WHERE key = ?", (key,))
+                self._bytes -= size
+                if self._bytes <= target:
+                    break
+
+    def close(self):
+        """Close the database, which folds the WAL back into it
+
+        Prefetches still running afterwards find nothing and store nothing.
+        """
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class Prefetcher:
+    """Decode and resize images on a worker thread pool ahead of display
+
+    Results are only ever stored in the cache; the Tk main thread picks
+    them up from there, so no Tk calls are made from worker threads.
+    """
+
+    def __init__(self, cache, workers=2, quality="fast", disk_cache=None,
+                 max_bytes=DEFAULT_MEMORY_LIMIT):
+        self.cache = cache
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.disk_cache = disk_cache
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers),
+                                            thread_name_prefix="prefetch")
+        self._pending = {}              # Maps cache keys to in-flight futures
+        self._failures = {}             # Maps cache keys to (file mtime, decode error message)
+        self._lock = threading.Lock()
+
+    def _load(self, image_path, box):
+        """Get a preview from the disk cache or by decoding the file"""
+        if self.disk_cache is None:
+            return load_preview(image_path, box, self.quality, self.max_bytes)
+            
+        disk_key = DiskPreviewCache.make_key(file_fingerprint(image_path), box, self.quality)
+        try:
+            img = self.disk_cache.get(disk_key)
+        except Exception as e:
+            print(f"Error reading preview cache: {str(e)}")
+            img = None
+        if img is None:
+            img = load_preview(image_path, box, self.quality, self.max_bytes)
+            try:
+                self.disk_cache.put(disk_key, img)
+            except Exception as e:
+                print(f"Error writing preview cache: {str(e)}")
+        return img
+
+    def _decode(self, key):
+        """Worker task: decode one preview and store it in the cache"""
+        try:
+            img = self._load(*key)
+            self.cache.put(key, img)
+            return img
+        except Exception as e:
+            # Remember the error so the file is not queued again and again, until it changes
+            with self._lock:
+                self._failures[key] = (file_mtime(key[0]), str(e))
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def get(self, image_path, box):
+        """Return the preview for image_path, decoding it now if needed"""
+        key = (image_path, box)
+        img = self.cache.get(key)
+        if img is not None:
+            return img
+
+        # Wait for a prefetch that is already running rather than decoding twice
+        with self._lock:
+            future = self._pending.pop(key, None)
+        if future is not None and not future.cancel():
+            return future.result()
+
+        img = self._load(image_path, box)
+        self.cache.put(key, img)
+        return img
+
+    def prefetch(self, image_paths, box):
+        """Queue background decodes for image_paths, nearest first
+
+        Queued work for images that are no longer wanted is cancelled so
+        that jumping around does not leave the pool busy with stale decodes.
+        """
+        wanted = [(path, box) for path in image_paths]
+        wanted_set = set(wanted)
+        with self._lock:
+            for key, future in list(self._pending.items()):
+                if key not in wanted_set and future.cancel():
+                    del self._pending[key]
+
+            for key in wanted:
+                if key in self._pending or self._failed(key) or key in self.cache:
+                    continue
+                self._pending[key] = self._executor.submit(self._decode, key)
+
+    def is_pending(self, image_path, box):
+        """Check whether a background decode is queued or running"""
+        with self._lock:
+            return (image_path, box) in self._pending
+
+    def _failed(self, key):
+        """Get the remembered error for key if the file has not changed since (lock held)"""
+        failure = self._failures.get(key)
+        if failure is None:
+            return None
+        if failure[0] != file_mtime(key[0]):
+            # Written again (or replaced) since it failed; worth another try
+            del self._failures[key]
+            return None
+        return failure[1]
+
+    def failure(self, image_path, box):
+        """Return the error from a failed background decode, or None"""
+        with self._lock:
+            return self._failed((image_path, box))
+
+    def retry(self, image_path):
+        """Forget the errors remembered for a file so that it is decoded again"""
+        with self._lock:
+            for key in [k for k in self._failures if k[0] == image_path]:
+                del self._failures[key]
+
+    def forget(self, image_path):
+        """Drop cached previews and remembered errors for a file"""
+        self.cache.discard(image_path)
+        self.retry(image_path)
+
+    def shutdown(self):
+        """Cancel queued work and stop the worker threads"""
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,301 @@
+import json
+import os
+import queue
+import threading
+
+from instrumentation import timings
+from renamer_core import state_path
+
+# Number of completed renames kept in the journal for undo
+UNDO_HISTORY = 500
+
+
+class RenameJournal:
+    """Append-only log of the renames requested in one directory
+
+    Each line is a JSON record. A "rename" record is written (and synced to
+    disk) before the rename is attempted; a later "done", "failed" or
+    "undone" record with the same id tells what became of it. Renames with
+    no outcome were interrupted and are replayed by RenameQueue.recover().
+    A "next" record keeps ids increasing across sessions after the journal
+    has been trimmed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def read(self):
+        """Read all records, ignoring a torn last line from a crash"""
+        records = []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return records
+
+    def append(self, record):
+        """Write one record and make sure it reached the disk"""
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock, timings.stage("journal"):
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(line)
+                file.flush()
+                os.fsync(file.fileno())
+
+    def rewrite(self, records):
+        """Replace the journal with records, atomically"""
+        temp_path = self.path + ".tmp"
+        with self._lock:
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                for record in records:
+                    file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.path)
+
+
+class RenameQueue:
+    """Applies renames in one directory on a background thread
+
+    submit() journals a rename and returns at once; a single worker thread
+    performs the renames in submission order, so a rename that depends on
+    an earlier one (renaming the same file again, or undoing it) always
+    runs after it. Finished operations are collected with poll() from the
+    Tk main thread.
+    """
+
+    def __init__(self, directory, journal_path=None):
+        self.directory = directory
+        self.journal = RenameJournal(journal_path or state_path(directory, '.journal'))
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._pending = {}              # Maps op ids to submitted, unfinished ops
+        self._undo_stack = []           # Ops that can still be undone, oldest first
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._queued = 0                # Ops handed to the worker and not finished yet
+        self._worker = None
+        self.finished = []              # Ops of the journal that reached the disk, in order (see recover)
+
+    def recover(self):
+        """Finish renames interrupted by a crash and rebuild the undo history
+
+        Must be called before the directory is listed. Returns the list of
+        ops that were replayed, each with "status" and "error" filled in.
+        Afterwards finished lists every op of the journal that is done,
+        replayed or not, oldest first; ids only ever increase, so a saved
+        session can tell which of them it has not seen yet.
+        """
+        ops = {}
+        order = []
+        undone = set()
+        last_id = 0
+        for record in self.journal.read():
+            op_id = record.get("id")
+            kind = record.get("op")
+            if kind == "next":
+                last_id = max(last_id, op_id - 1)
+            elif kind == "rename":
+                ops[op_id] = dict(record, status="pending")
+                order.append(op_id)
+            elif kind in ("done", "failed") and op_id in ops:
+                ops[op_id]["status"] = kind
+            elif kind == "undone":
+                undone.add(op_id)
+        
+        replayed = []
+        for op_id in order:
+            op = ops[op_id]
+            if op["status"] == "pending":
+                self._apply(op, recovering=True)
+                replayed.append(op)
+            if op["status"] == "done" and op.get("undo_of") is not None:
+                undone.add(op["undo_of"])
+        
+        self.finished = [ops[op_id] for op_id in order if ops[op_id]["status"] == "done"]
+        
+        # Keep only what undo needs and start numbering after the old ids.
+        # Display indexes from an earlier session mean nothing now.
+        for op in ops.values():
+            op["index"] = None
+        self._undo_stack = [ops[op_id] for op_id in order
+                            if ops[op_id]["status"] == "done" and op_id not in undone
+                            and ops[op_id].get("undo_of") is None][-UNDO_HISTORY:]
+        self._next_id = max(max(order, default=0), last_id) + 1
+        self.journal.rewrite([self._record(op) for op in self._undo_stack] +
+                             [{"op": "done", "id": op["id"]} for op in self._undo_stack] +
+                             [{"op": "next", "id": self._next_id}])
+        return replayed
+
+    @staticmethod
+    def _record(op):
+        return {"op": "rename", "id": op["id"], "src": op["src"], "dst": op["dst"],
+                "index": op.get("index"), "undo_of": op.get("undo_of"), "batch": op.get("batch")}
+
+    def submit(self, src, dst, index=None, undo_of=None, batch=None):
+        """Journal a rename of src to dst and queue it for the worker
+
+        undo_of is the op (from pop_undo) that this rename reverts. Renames
+        with the same batch (see submit_batch) are undone together.
+        """
+        with self._lock:
+            op = {"id": self._next_id, "src": src, "dst": dst, "index": index,
+                  "undo_of": undo_of["id"] if undo_of else None, "undoes": undo_of,
+                  "batch": batch, "status": "pending", "error": None}
+            self._next_id += 1
+        
+        self.journal.append(self._record(op))
+        with self._lock:
+            self._pending[op["id"]] = op
+            if undo_of is None:
+                self._undo_stack.append(op)
+                del self._undo_stack[:-UNDO_HISTORY]
+        
+        self._ensure_worker()
+        with self._lock:
+            self._queued += 1
+        self._jobs.put(op)
+        return op
+
+    def submit_batch(self, renames):
+        """Submit (src, dst, index) renames that pop_undo_batch returns together"""
+        batch = self._next_id
+        return [self.submit(src, dst, index, batch=batch) for src, dst, index in renames]
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name="rename-queue", daemon=True)
+            self._worker.start()
+
+    def _apply(self, op, recovering=False):
+        """Perform one rename and journal its outcome"""
+        source_path = os.path.join(self.directory, op["src"])
+        dest_path = os.path.join(self.directory, op["dst"])
+        try:
+            if recovering and os.path.exists(dest_path) and not os.path.exists(source_path):
+                # Already renamed before the crash
+                pass
+            elif os.path.exists(dest_path):
+                # os.rename would silently replace it on some platforms
+                raise FileExistsError(f"'{op['dst']}' already exists")
+            else:
+                with timings.stage("os_rename"):
+                    os.rename(source_path, dest_path)
+            op["status"] = "done"
+        except OSError as e:
+            op["status"] = "failed"
+            op["error"] = str(e)
+        
+        if op["status"] == "done":
+            self.journal.append({"op": "done", "id": op["id"]})
+            if op.get("undo_of") is not None:
+                self.journal.append({"op": "undone", "id": op["undo_of"]})
+        else:
+            self.journal.append({"op": "failed", "id": op["id"], "error": op["error"]})
+
+    def _run(self):
+        """Worker thread: apply queued renames in order"""
+        while True:
+            op = self._jobs.get()
+            if op is None:
+                return
+            try:
+                self._apply(op)
+            except Exception as e:
+                # Journal write failed; report it like a failed rename
+                op["status"] = "failed"
+                op["error"] = str(e)
+            self._results.put(op)
+            with self._idle:
+                self._queued -= 1
+                self._idle.notify_all()
+
+    def poll(self):
+        """Return the ops that finished since the last poll (main thread)"""
+        finished = []
+        while True:
+            try:
+                op = self._results.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._pending.pop(op["id"], None)
+                if op["status"] == "failed":
+                    if op in self._undo_stack:
+                        self._undo_stack.remove(op)
+                    elif op["undoes"] is not None:
+                        # The undo did not happen, so it can be tried again
+                        self._restore_undo(op["undoes"])
+            finished.append(op)
+        return finished
+
+    def pending(self):
+        """List the submitted ops that have not been reported by poll() yet"""
+        with self._lock:
+            return list(self._pending.values())
+
+    def pending_target(self, index):
+        """Get the name the image at a display index will have once its queued renames land"""
+        target = None
+        for op in self.pending():
+            if op.get("index") == index:
+                target = op["dst"]
+        return target
+
+    def can_undo(self):
+        return bool(self._undo_stack)
+
+    def pop_undo(self):
+        """Remove and return the most recent rename that can be undone, or None"""
+        with self._lock:
+            return self._undo_stack.pop() if self._undo_stack else None
+
+    def pop_undo_batch(self):
+        """Remove and return the most recent rename and the rest of its batch, newest first"""
+        with self._lock:
+            if not self._undo_stack:
+                return []
+            ops = [self._undo_stack.pop()]
+            batch = ops[0].get("batch")
+            while batch is not None and self._undo_stack and self._undo_stack[-1].get("batch") == batch:
+                ops.append(self._undo_stack.pop())
+            return ops
+
+    def restore_undo(self, op):
+        """Put back an op taken with pop_undo that was not undone after all"""
+        with self._lock:
+            self._restore_undo(op)
+
+    def _restore_undo(self, op):
+        self._undo_stack.append(op)
+        self._undo_stack.sort(key=lambda undo_op: undo_op["id"])
+
+    def wait_idle(self, timeout=None):
+        """Wait until every queued rename has been tried and journaled
+
+        The worker keeps running. Returns False if timeout seconds passed first.
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._queued == 0, timeout)
+
+    def close(self, timeout=None):
+        """Let the worker finish the queued renames and stop
+
+        With a timeout, wait up to that many seconds for it; renames still
+        queued after that are replayed from the journal next time. Returns
+        False if the worker is still running.
+        """
+        if self._worker is not None:
+            self._jobs.put(None)
+            if timeout:
+                self._worker.join(timeout)
+            return not self._worker.is_alive()
+        return True
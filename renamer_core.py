@@ -0,0 +1,448 @@
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+
+from instrumentation import timings
+
+# File extensions treated as images
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff')
+
+
+def app_data_dir():
+    """Get the per-user directory for caches, journals and session state"""
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+        return os.path.join(base, 'ImageRenamer')
+    base = os.environ.get('XDG_STATE_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'state')
+    return os.path.join(base, 'image-renamer')
+
+
+def state_path(directory, suffix):
+    """Get the per-user file holding state of kind suffix for a directory"""
+    key = os.path.normcase(os.path.abspath(directory)).encode('utf-8', 'surrogateescape')
+    return os.path.join(app_data_dir(), 'folders', hashlib.sha1(key).hexdigest()[:16] + suffix)
+
+
+def is_image_file(filename):
+    """Check whether a filename has one of the supported image extensions"""
+    return filename.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def split_suffix(base):
+    """Split a 'name_<digits>' base into (name, digits), or return (base, None)
+
+    Only ASCII digits count; "Tag_²" is a plain name, not a suffix.
+    """
+    name, sep, digits = base.rpartition("_")
+    if sep and digits.isascii() and digits.isdigit():
+        return name, digits
+    return base, None
+
+
+class NameIndex:
+    """Index of the names used by the files in a directory
+
+    A file counts as using a name when its base is exactly the name or the
+    name followed by an underscore and digits ("Tag.jpg", "Tag_3.jpg").
+    For collision suffixes the index also remembers which numbered
+    filenames are taken for each name and extension, so the next free
+    "name_N" filename is found without touching the filesystem.
+    """
+
+    def __init__(self, filenames=()):
+        self._bases = {}                # Maps names to the number of files using them
+        self._taken = {}                # Maps (name, ext) keys to taken suffix numbers
+        self._next = {}                 # Maps (name, ext) keys to the lowest possibly free suffix
+        for filename in filenames:
+            self.add(filename)
+
+    @staticmethod
+    def _key(name, ext):
+        # Collisions follow the filesystem's case rules, like os.path.exists
+        return os.path.normcase(name), os.path.normcase(ext)
+
+    @staticmethod
+    def _parts(filename):
+        """Yield the names a filename uses, with their suffix number (0 for none)"""
+        base, ext = os.path.splitext(filename)
+        yield base, ext, 0
+        name, digits = split_suffix(base)
+        if digits is not None:
+            number = int(digits)
+            # "Tag_01" does not block "Tag_1", only the canonical spelling does
+            yield name, ext, number if number > 0 and str(number) == digits else None
+
+    def add(self, filename):
+        """Record a filename that now exists in the directory"""
+        for name, ext, number in self._parts(filename):
+            self._bases[name] = self._bases.get(name, 0) + 1
+            if number is not None:
+                self._taken.setdefault(self._key(name, ext), set()).add(number)
+
+    def remove(self, filename):
+        """Record a filename that no longer exists in the directory"""
+        for name, ext, number in self._parts(filename):
+            count = self._bases.get(name, 0) - 1
+            if count > 0:
+                self._bases[name] = count
+            else:
+                self._bases.pop(name, None)
+                
+            if number is None:
+                continue
+            key = self._key(name, ext)
+            taken = self._taken.get(key)
+            if taken is None:
+                continue
+            taken.discard(number)
+            if not taken:
+                del self._taken[key]
+                self._next.pop(key, None)
+            elif number and number < self._next.get(key, 1):
+                self._next[key] = number
+
+    def is_used(self, name):
+        """Check whether any file uses name"""
+        return name in self._bases
+
+    def used_names(self, names):
+        """Return the subset of names that are used by files"""
+        return {name for name in names if name in self._bases}
+
+    def unique_filename(self, name, ext):
+        """Return name + ext, or the first free name_N + ext if that is taken"""
+        key = self._key(name, ext)
+        taken = self._taken.get(key)
+        if not taken or 0 not in taken:
+            return f"{name}{ext}"
+            
+        # Add a number to make the filename unique
+        count = self._next.get(key, 1)
+        while count in taken:
+            count += 1
+        self._next[key] = count
+        return f"{name}_{count}{ext}"
+
+
+class DirectoryIndex:
+    """In-memory listing of a single directory
+
+    The directory is listed once with os.scandir. After that the app keeps
+    the index up to date itself when it renames files, and revalidate()
+    only rescans when the directory's modification time shows that
+    something else changed it. An index can also be restored from a saved
+    listing() without touching the disk; revalidate() then tells whether
+    the listing is still current.
+    """
+
+    def __init__(self, directory, listing=None):
+        self.directory = directory
+        self.mtime = None
+        self._entries = {}              # Maps normcased names to actual names
+        self._images = {}               # Image filenames in listing order
+        self.subdirs = []               # Names of subdirectories (symlinks not followed)
+        self.name_index = NameIndex()
+        if listing is None:
+            self.scan()
+        else:
+            self.restore(listing)
+
+    def scan(self):
+        """List the directory from scratch"""
+        with timings.stage("scan"):
+            mtime = os.stat(self.directory).st_mtime_ns
+            entries = {}
+            images = {}
+            subdirs = []
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    entries[os.path.normcase(entry.name)] = entry.name
+                    if is_image_file(entry.name) and entry.is_file():
+                        images[entry.name] = None
+                    elif entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+            self._entries = entries
+            self._images = images
+            self.subdirs = subdirs
+            self.name_index = NameIndex(entries.values())
+        self.mtime = mtime
+
+    def listing(self):
+        """Get the index as a JSON-compatible dict that restore() reads back"""
+        return {"mtime": self.mtime, "images": list(self._images),
+                "other": [name for name in self._entries.values() if name not in self._images],
+                "subdirs": self.subdirs}
+
+    def restore(self, listing):
+        """Load a saved listing() instead of scanning"""
+        names = listing["images"] + listing["other"]
+        self._entries = {os.path.normcase(name): name for name in names}
+        self._images = dict.fromkeys(listing["images"])
+        self.subdirs = list(listing["subdirs"])
+        self.name_index = NameIndex(names)
+        self.mtime = listing["mtime"]
+
+    def revalidate(self):
+        """Rescan if the directory changed on disk; return True if it did"""
+        with timings.stage("revalidate"):
+            unchanged = os.stat(self.directory).st_mtime_ns == self.mtime
+        if unchanged:
+            return False
+        self.scan()
+        return True
+
+    def touch(self):
+        """Record the directory's current mtime after the app changed it"""
+        try:
+            self.mtime = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            # Force a rescan on the next revalidate
+            self.mtime = None
+
+    def images(self):
+        """List the image files in directory listing order"""
+        return list(self._images)
+
+    def __contains__(self, filename):
+        """Check whether the directory has an entry with exactly this name"""
+        return self._entries.get(os.path.normcase(filename)) == filename
+
+    def __len__(self):
+        return len(self._images)
+
+    def exists(self, filename):
+        """Check whether a path with this name exists, like os.path.exists"""
+        return os.path.normcase(filename) in self._entries
+
+    def names(self):
+        """List every entry in the directory, images or not"""
+        return list(self._entries.values())
+
+    def add(self, filename, is_dir=False):
+        """Record a file (or subdirectory) that was created in the directory"""
+        key = os.path.normcase(filename)
+        if key in self._entries:
+            self.remove(self._entries[key])
+        self._entries[key] = filename
+        self.name_index.add(filename)
+        if is_dir:
+            self.subdirs.append(filename)
+        elif is_image_file(filename):
+            self._images[filename] = None
+
+    def remove(self, filename):
+        """Record a file that was removed from the directory"""
+        actual = self._entries.pop(os.path.normcase(filename), None)
+        if actual is None:
+            return
+        self.name_index.remove(actual)
+        self._images.pop(actual, None)
+        if actual in self.subdirs:
+            self.subdirs.remove(actual)
+
+    def unique_filename(self, name, ext):
+        """Return a filename for name + ext that does not collide with any entry"""
+        return self.name_index.unique_filename(name, ext)
+
+    def rename(self, old_filename, new_filename):
+        """Record a rename done by the app and remember the new mtime"""
+        self.remove(old_filename)
+        self.add(new_filename)
+        self.touch()
+
+
+def walk_directories(base, roots, recursive=True, stop=None, exclude=()):
+    """Yield (relative_dir, DirectoryIndex) for each directory of a session
+
+    roots are listed in order, each followed (if recursive) by its
+    subdirectories, depth first and alphabetically. Directories are listed
+    one at a time, so a caller can show the images of the first folders
+    while the rest are still being listed. relative_dir is relative to
+    base ("" for base itself). Hidden folders (".git", ...) are skipped,
+    symlinked folders are not followed and a folder reached twice is
+    listed once. Folders in exclude (e.g. the export folder) are skipped
+    with everything below them. Setting the stop event ends the walk early.
+    """
+    seen = {os.path.normcase(os.path.abspath(directory)) for directory in exclude}
+    pending = list(reversed(roots))
+    while pending:
+        if stop is not None and stop.is_set():
+            return
+        directory = pending.pop()
+        key = os.path.normcase(os.path.abspath(directory))
+        if key in seen:
+            continue
+        seen.add(key)
+        
+        try:
+            dir_index = DirectoryIndex(directory)
+        except OSError as e:
+            print(f"Error listing {directory}: {str(e)}")
+            continue
+        relative_dir = os.path.relpath(directory, base)
+        yield ("" if relative_dir == os.curdir else relative_dir), dir_index
+        
+        if recursive:
+            subdirs = sorted((name for name in dir_index.subdirs if not name.startswith(".")),
+                             key=str.lower, reverse=True)
+            pending.extend(os.path.join(directory, name) for name in subdirs)
+
+
+def session_base(roots):
+    """Get the folder that session paths are relative to: the roots' common parent
+
+    Raises ValueError if the roots have no common parent (different drives).
+    """
+    roots = [os.path.abspath(root) for root in roots]
+    if len(roots) == 1:
+        return roots[0]
+    return os.path.commonpath(roots)
+
+
+def load_name_list(file_path):
+    """Read a name list file: one name per line, blank lines ignored"""
+    with open(file_path, 'r') as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def plan_rename(dir_index, filename, name):
+    """Reserve the new filename for renaming filename to name in the index
+
+    The index is updated as if the rename had happened, so later renames
+    see the reserved name as taken; the file itself is not touched.
+    Returns the new filename.
+    """
+    file_ext = os.path.splitext(filename)[1]
+    new_name = dir_index.unique_filename(name, file_ext)
+    dir_index.remove(filename)
+    dir_index.add(new_name)
+    return new_name
+
+
+def rename_file(dir_index, filename, name, dry_run=False):
+    """Rename a file in an indexed directory to name, keeping its extension
+
+    If name is already taken the first free name_N is used, exactly like the
+    GUI does. A file that another program created under the chosen name
+    since the directory was listed is never replaced (os.rename would, on
+    POSIX); the next free name is used instead. The index is updated but
+    its mtime is not re-read; callers doing many renames should call
+    dir_index.touch() once when finished. Returns the new filename.
+    """
+    file_ext = os.path.splitext(filename)[1]
+    source_path = os.path.join(dir_index.directory, filename)
+    while True:
+        new_name = dir_index.unique_filename(name, file_ext)
+        if dry_run:
+            break
+        dest_path = os.path.join(dir_index.directory, new_name)
+        # The same file under another case on case-insensitive file systems is fine
+        if os.path.exists(dest_path) and not os.path.samefile(source_path, dest_path):
+            dir_index.add(new_name)
+            continue
+        os.rename(source_path, dest_path)
+        break
+    
+    dir_index.remove(filename)
+    dir_index.add(new_name)
+    return new_name
+
+
+def invalid_name(name):
+    """Get why a new name from a mapping cannot be used, or None if it can
+
+    Names become file names in the source's own folder, so anything that
+    would point elsewhere is refused.
+    """
+    if not isinstance(name, str) or not name.strip():
+        return "The new name is empty"
+    if '/' in name or '\\' in name:
+        return f"The new name {name!r} contains a path separator"
+    if name.strip() in ('.', '..'):
+        return f"The new name {name!r} is not a file name"
+    return None
+
+
+def load_mapping(file_path):
+    """Load a source filename -> name mapping from a CSV or JSON file
+
+    CSV files have two columns (source, name); a header row naming those
+    columns is optional. JSON files hold either an object of source: name
+    pairs or a list of [source, name] pairs or {"source", "name"} objects.
+    Returns a list of (source, name) pairs in file order; names are not
+    checked here, batch_rename reports unusable ones (see invalid_name) as
+    failed.
+    """
+    if file_path.lower().endswith('.json'):
+        with open(file_path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        if isinstance(data, dict):
+            return list(data.items())
+        return [(item['source'], item['name']) if isinstance(item, dict) else tuple(item)
+                for item in data]
+    
+    pairs = []
+    with open(file_path, 'r', newline='', encoding='utf-8-sig') as file:
+        for row_number, row in enumerate(csv.reader(file)):
+            if not row or not any(cell.strip() for cell in row):
+                continue
+            if len(row) < 2:
+                raise ValueError(f"Line {row_number + 1}: expected 'source,name'")
+            source, name = row[0].strip(), row[1].strip()
+            if row_number == 0 and (source.lower(), name.lower()) == ('source', 'name'):
+                continue
+            pairs.append((source, name))
+    return pairs
+
+
+class BatchResult:
+    """Counts and per-file problems from a batch rename"""
+
+    def __init__(self):
+        self.renamed = []               # (source, new filename) pairs
+        self.missing = []               # Sources not found in the directory
+        self.failed = []                # (source, error message) pairs
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        """Files processed per second"""
+        processed = len(self.renamed) + len(self.missing) + len(self.failed)
+        return processed / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def batch_rename(directory, mapping, dry_run=False, progress=None, progress_every=1000):
+    """Apply (source, name) pairs to the files in directory
+
+    The directory is listed once; every rename after that is checked
+    against the in-memory index, so collisions get the same name_N
+    suffixes as renaming one image at a time in the GUI. progress, if
+    given, is called with (done, total, result) every progress_every files.
+    """
+    result = BatchResult()
+    start = time.perf_counter()
+    dir_index = DirectoryIndex(directory)
+    
+    for done, (source, name) in enumerate(mapping, 1):
+        problem = invalid_name(name)
+        if problem:
+            result.failed.append((source, problem))
+        elif source not in dir_index:
+            result.missing.append(source)
+        else:
+            try:
+                result.renamed.append((source, rename_file(dir_index, source, name, dry_run)))
+            except OSError as e:
+                result.failed.append((source, str(e)))
+        
+        if progress and done % progress_every == 0:
+            result.elapsed = time.perf_counter() - start
+            progress(done, len(mapping), result)
+    
+    if not dry_run:
+        dir_index.touch()
+    result.elapsed = time.perf_counter() - start
+    return result
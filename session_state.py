@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+
+from instrumentation import timings
+from renamer_core import DirectoryIndex
+
+# Layout version of the state file; files of other versions are ignored
+STATE_VERSION = 2
+
+# Delta records after which the file is rewritten as a single snapshot
+COMPACT_AFTER = 2000
+
+
+class SessionState:
+    """Saved order, position and folder listings of a session, for resuming it
+
+    The file holds one snapshot record followed by small delta records
+    appended as the session goes on, one JSON record per line:
+
+        {"at": index}                                   current image changed
+        {"renamed": index, "src": path, "dst": path,    a rename reached the disk
+         "mtime": ns, "id": op_id}
+        {"stale": relative_dir}                         a folder was changed
+                                                        by something else
+
+    restore() replays the deltas onto the snapshot without touching the
+    disk; the caller then checks each folder's mtime and lists again only
+    the folders that changed. The id of the last rename the file knows
+    about tells the caller which renames of the journal to apply on top. Appends are not synced: the file is only a
+    shortcut, and anything it gets wrong is caught by the mtime check.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.ready = False              # Deltas are only written after a snapshot
+        self._deltas = 0
+        self._position = None
+        self._lock = threading.Lock()
+
+    def restore(self, base, roots, recursive):
+        """Read the saved session of these folders, or None if there is none
+
+        Returns a dict with display_order, filename_map, current_index,
+        dir_indexes (DirectoryIndex objects built from the saved listings,
+        whose mtimes still have to be checked) and last_rename (the
+        journal id of the last rename included).
+        """
+        records = []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # Torn last line from a crash
+                        continue
+        except OSError:
+            return None
+
+        if not records:
+            return None
+        snapshot = records[0]
+        if (snapshot.get("version") != STATE_VERSION or snapshot.get("roots") != list(roots)
+                or snapshot.get("recursive") != recursive or not snapshot.get("display_order")):
+            return None
+
+        try:
+            display_order = snapshot["display_order"]
+            filename_map = dict(enumerate(display_order))
+            for index, path in snapshot["renamed"]:
+                filename_map[index] = path
+            current_index = snapshot["current_index"]
+            last_rename = snapshot["last_rename"]
+            dir_indexes = {directory: DirectoryIndex(os.path.join(base, directory), listing)
+                           for directory, listing in snapshot["dirs"].items()}
+
+            stale = set()
+            for record in records[1:]:
+                if "at" in record:
+                    current_index = record["at"]
+                elif "renamed" in record:
+                    filename_map[record["renamed"]] = record["dst"]
+                    last_rename = max(last_rename, record["id"])
+                    directory, src = os.path.split(record["src"])
+                    dir_index = dir_indexes[directory]
+                    dir_index.remove(src)
+                    dir_index.add(os.path.basename(record["dst"]))
+                    if directory not in stale:
+                        dir_index.mtime = record["mtime"]
+                elif "stale" in record:
+                    stale.add(record["stale"])
+
+            # Listed again on resume whatever their mtime says
+            for directory in stale:
+                if directory in dir_indexes:
+                    dir_indexes[directory].mtime = None
+        except (KeyError, TypeError, ValueError, IndexError) as e:
+            print(f"Error reading session state: {str(e)}")
+            return None
+
+        self._deltas = len(records) - 1
+        self._position = current_index
+        return {"display_order": display_order, "filename_map": filename_map,
+                "current_index": current_index, "dir_indexes": dir_indexes, "last_rename": last_rename}
+
+    def save(self, roots, recursive, display_order, filename_map, current_index, dir_indexes,
+             last_rename=0):
+        """Replace the file with a snapshot of the session, atomically
+
+        last_rename is the journal id of the last rename that filename_map
+        includes.
+        """
+        snapshot = {
+            "version": STATE_VERSION,
+            "roots": list(roots),
+            "recursive": recursive,
+            "display_order": display_order,
+            # Only images that no longer carry their original name
+            "renamed": [[index, path] for index, path in filename_map.items()
+                        if path != display_order[index]],
+            "current_index": current_index,
+            "last_rename": last_rename,
+            "dirs": {directory: dir_index.listing() for directory, dir_index in dir_indexes.items()},
+        }
+        temp_path = self.path + ".tmp"
+        try:
+            with self._lock, timings.stage("save_state"):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(temp_path, 'w', encoding='utf-8') as file:
+                    json.dump(snapshot, file, ensure_ascii=False, separators=(",", ":"))
+                    file.write("\n")
+                os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Error saving session state: {str(e)}")
+            return
+        self.ready = True
+        self._deltas = 0
+        self._position = current_index
+
+    def append(self, record):
+        """Add one delta record; returns True when the file should be compacted with save()"""
+        if not self.ready:
+            return False
+        try:
+            with self._lock:
+                with open(self.path, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        except OSError as e:
+            print(f"Error saving session state: {str(e)}")
+            return False
+        self._deltas += 1
+        return self._deltas >= COMPACT_AFTER
+
+    def record_position(self, index):
+        """Remember the current image; returns True when the file should be compacted"""
+        if index == self._position:
+            return False
+        self._position = index
+        return self.append({"at": index})
+
+    def record_rename(self, index, src, dst, mtime, op_id):
+        """Remember a rename that reached the disk and the folder's mtime after it"""
+        return self.append({"renamed": index, "src": src, "dst": dst, "mtime": mtime, "id": op_id})
+
+    def record_stale(self, directory):
+        """Remember that a folder changed outside the app since the snapshot"""
+        return self.append({"stale": directory})
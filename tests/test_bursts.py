@@ -0,0 +1,90 @@
+import os
+import random
+import sys
+import unittest
+from itertools import combinations
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bursts
+from bursts import DEFAULT_WINDOW, find_similar_pairs, hamming_distance
+
+
+def brute_force_pairs(hashes, keys, threshold):
+    return sorted((i, j) for i, j in combinations(range(len(hashes)), 2)
+                  if keys[i] == keys[j] and hamming_distance(hashes[i], hashes[j]) <= threshold)
+
+
+def shuffled_bursts(rng, bases, shots, flips):
+    """Hashes of bases bursts of shots each, with up to flips bits changed per shot, shuffled"""
+    hashes = []
+    for _ in range(bases):
+        base = rng.getrandbits(64)
+        for _ in range(shots):
+            value = base
+            for bit in rng.sample(range(64), rng.randint(0, flips)):
+                value ^= 1 << bit
+            hashes.append(value)
+    rng.shuffle(hashes)
+    return hashes
+
+
+@unittest.skipIf(bursts.np is None, "NumPy is not installed")
+class FindSimilarPairsTest(unittest.TestCase):
+
+    def test_matches_brute_force_on_shuffled_hashes(self):
+        rng = random.Random(1)
+        for threshold in (0, 3, 6, 10):
+            hashes = shuffled_bursts(rng, 300, 4, threshold + 1)
+            keys = [0] * len(hashes)
+            self.assertGreater(len(hashes), DEFAULT_WINDOW)
+            self.assertEqual(sorted(find_similar_pairs(hashes, threshold=threshold)),
+                             brute_force_pairs(hashes, keys, threshold))
+
+    def test_runs_longer_than_the_window(self):
+        # Many hashes sharing every band value but one bit apart
+        hashes = [(1 << 63) | (1 << bit) for bit in range(40)]
+        keys = [0] * len(hashes)
+        self.assertEqual(sorted(find_similar_pairs(hashes, threshold=2)),
+                         brute_force_pairs(hashes, keys, 2))
+
+    def test_keys_and_missing_hashes(self):
+        rng = random.Random(2)
+        hashes = shuffled_bursts(rng, 100, 3, 6)
+        keys = [rng.randint(0, 2) for _ in hashes]
+        hashes[5] = None
+        expected = [(i, j) for i, j in brute_force_pairs([h or 0 for h in hashes], keys, 6)
+                    if hashes[i] is not None and hashes[j] is not None]
+        self.assertEqual(sorted(find_similar_pairs(hashes, keys, 6)), expected)
+
+
+class GroupSimilarTest(unittest.TestCase):
+
+    def test_identical_hashes_form_one_group_per_folder(self):
+        hashes = [7] * 500 + [None, 7]
+        keys = [0] * 250 + [1] * 250 + [0, 1]
+        self.assertEqual(bursts.group_similar(hashes, keys),
+                         [list(range(250)), list(range(250, 500)) + [501]])
+
+    def test_groups_match_brute_force(self):
+        rng = random.Random(3)
+        hashes = shuffled_bursts(rng, 200, 3, 6)
+        hashes += hashes[:20]
+        keys = [0] * len(hashes)
+        parent = list(range(len(hashes)))
+
+        def find(i):
+            while parent[i] != i:
+                i = parent[i]
+            return i
+        for i, j in brute_force_pairs(hashes, keys, 6):
+            parent[max(find(i), find(j))] = min(find(i), find(j))
+        groups = {}
+        for i in range(len(hashes)):
+            groups.setdefault(find(i), []).append(i)
+        expected = sorted(members for members in groups.values() if len(members) > 1)
+        self.assertEqual(bursts.group_similar(hashes, keys, 6), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from renamer_core import DirectoryIndex, NameIndex, rename_file, split_suffix
+
+
+class SplitSuffixTest(unittest.TestCase):
+
+    def test_ascii_digits_are_a_suffix(self):
+        self.assertEqual(split_suffix("Tag_3"), ("Tag", "3"))
+
+    def test_other_digits_are_part_of_the_name(self):
+        for base in ("Tag_²", "Tag_٣", "Tag_３"):
+            self.assertEqual(split_suffix(base), (base, None))
+
+
+class NameIndexTest(unittest.TestCase):
+
+    def test_non_ascii_digit_names_are_plain_names(self):
+        index = NameIndex(["Tag_².jpg", "Tag.jpg"])
+        self.assertTrue(index.is_used("Tag_²"))
+        # Not taken as "Tag_2", so that suffix is still free
+        self.assertEqual(index.unique_filename("Tag", ".jpg"), "Tag_1.jpg")
+        index.add("Tag_1.jpg")
+        self.assertEqual(index.unique_filename("Tag", ".jpg"), "Tag_2.jpg")
+
+    def test_directory_with_non_ascii_digit_name_is_indexed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for filename in ("Tag_².jpg", "Tag.jpg"):
+                open(os.path.join(directory, filename), "wb").close()
+            dir_index = DirectoryIndex(directory)
+            self.assertIn("Tag_².jpg", dir_index)
+
+
+class RenameFileTest(unittest.TestCase):
+
+    def test_file_created_after_listing_is_not_replaced(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for filename in ("a.jpg", "b.jpg"):
+                with open(os.path.join(directory, filename), "w") as file:
+                    file.write(filename)
+            dir_index = DirectoryIndex(directory)
+            # Another program saves files under the names the index thinks are free
+            for filename in ("Tag.jpg", "Tag_1.jpg"):
+                with open(os.path.join(directory, filename), "w") as file:
+                    file.write("outside")
+
+            self.assertEqual(rename_file(dir_index, "a.jpg", "Tag"), "Tag_2.jpg")
+            self.assertEqual(rename_file(dir_index, "b.jpg", "Tag"), "Tag_3.jpg")
+            for filename in ("Tag.jpg", "Tag_1.jpg"):
+                with open(os.path.join(directory, filename)) as file:
+                    self.assertEqual(file.read(), "outside")
+            with open(os.path.join(directory, "Tag_2.jpg")) as file:
+                self.assertEqual(file.read(), "a.jpg")
+
+
+if __name__ == "__main__":
+    unittest.main()
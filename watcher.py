@@ -0,0 +1,368 @@
+import abc
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+
+# inotify event flags (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class DirectoryWatcher(abc.ABC):
+    """Reports changes made to a session's folders by other programs
+
+    Folders are given relative to base, as in the app's session. Changes
+    are collected on a background thread and handed over in batches by
+    events(), which the Tk main thread polls. Each event is a tuple:
+
+        ("created", folder, name)           a file or folder appeared
+        ("deleted", folder, name)           a file or folder went away
+        ("renamed", folder, name, new_folder, new_name)
+        ("modified", folder, name)          a file was written
+        ("rescan", folder)                  list the folder again (folder is
+                                            None for every folder)
+
+    Created and deleted events for subfolders carry a trailing "/" on
+    the name. Renames done by the app itself are reported too; applying
+    them again has no effect.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self._events = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @abc.abstractmethod
+    def watch(self, folder, mtime=None):
+        """Start watching a folder; a folder whose mtime is no longer mtime is rescanned"""
+
+    def expect(self, folder, name, new_name):
+        """Note a rename the app is about to make in folder
+
+        Watchers that list folders use this to skip listing a folder whose
+        only change is the app's own renames.
+        """
+
+    def events(self):
+        """Take the events collected since the last call (main thread)"""
+        with self._lock:
+            events, self._events = self._events, []
+        return events
+
+    def _emit(self, events):
+        if events:
+            with self._lock:
+                self._events.extend(events)
+
+    def _start(self, target, name):
+        self._thread = threading.Thread(target=target, name=name, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop watching"""
+        self._stop.set()
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+    return libc
+
+
+class InotifyWatcher(DirectoryWatcher):
+    """DirectoryWatcher using Linux inotify; the kernel reports each change"""
+
+    def __init__(self, base, libc):
+        super().__init__(base)
+        self._libc = libc
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._folders = {}              # Maps watch descriptors to folders
+        self._start(self._run, "folder-watcher")
+
+    def watch(self, folder, mtime=None):
+        path = os.path.join(self.base, folder)
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            print(f"Error watching {path}: {os.strerror(ctypes.get_errno())}")
+            return
+        self._folders[wd] = folder
+
+        # Changes made between the listing and the watch
+        try:
+            if mtime is not None and os.stat(path).st_mtime_ns != mtime:
+                self._emit([("rescan", folder)])
+        except OSError:
+            pass
+
+    def _read(self, timeout):
+        """Read the raw events that arrive within timeout seconds"""
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self._fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+        raw = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            raw.append((wd, mask, cookie, name))
+        return raw
+
+    def _run(self):
+        """Watcher thread: turn inotify events into DirectoryWatcher events"""
+        try:
+            while not self._stop.is_set():
+                raw = self._read(0.5)
+                if not raw:
+                    continue
+
+                # The two halves of a rename can arrive in separate reads
+                if any(mask & IN_MOVED_FROM for _, mask, _, _ in raw):
+                    raw += self._read(0.05)
+                self._emit(self._translate(raw))
+        finally:
+            os.close(self._fd)
+
+    def _translate(self, raw):
+        events = []
+        moved_from = {}
+        for wd, mask, cookie, name in raw:
+            if mask & IN_Q_OVERFLOW:
+                events.append(("rescan", None))
+                continue
+            folder = self._folders.get(wd)
+            if folder is None:
+                continue
+            if mask & IN_ISDIR and name:
+                name += "/"
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                self._folders.pop(wd, None)
+                events.append(("rescan", folder))
+            elif mask & IN_MOVED_FROM:
+                moved_from[cookie] = (folder, name)
+                events.append(("moved_from", cookie))
+            elif mask & IN_MOVED_TO:
+                source = moved_from.pop(cookie, None)
+                if source is None:
+                    events.append(("created", folder, name))
+                else:
+                    events.append(("renamed", source[0], source[1], folder, name))
+            elif mask & IN_CREATE:
+                events.append(("created", folder, name))
+            elif mask & IN_DELETE:
+                events.append(("deleted", folder, name))
+            elif mask & IN_CLOSE_WRITE:
+                events.append(("modified", folder, name))
+
+        # Files moved out of the watched folders have no second half
+        translated = []
+        for event in events:
+            if event[0] != "moved_from":
+                translated.append(event)
+            elif event[1] in moved_from:
+                translated.append(("deleted",) + moved_from[event[1]])
+        return translated
+
+
+class PollingWatcher(DirectoryWatcher):
+    """DirectoryWatcher for systems without inotify
+
+    Every interval seconds each folder's mtime is checked (one stat per
+    folder); only folders that changed are listed, and the listing is
+    compared with the previous one. A file that disappeared under one
+    name and appeared under another with the same inode, size and mtime
+    was renamed (a rename keeps all three, while a new file that happens
+    to reuse a deleted file's inode does not). A file whose size or mtime
+    changed under the same name was modified; files rewritten in place
+    leave the folder's mtime alone, though, so they are only noticed
+    once something else in the folder changes.
+
+    A folder whose only change is renames the app announced through
+    expect() is not listed in full: its names are read without stat
+    calls and checked against the expected result.
+    """
+
+    def __init__(self, base, interval=2.0):
+        super().__init__(base)
+        self.interval = interval
+        self._folders = {}              # Maps folders to (mtime, {name: identity})
+        self._new = []                  # (folder, mtime) waiting for a first listing
+        self._expected = {}             # Maps folders to [(name, new_name)] the app is renaming
+        self._wake = threading.Event()
+        self._start(self._run, "folder-watcher")
+
+    def watch(self, folder, mtime=None):
+        with self._lock:
+            self._new.append((folder, mtime))
+        # List new folders right away so that later changes are not missed
+        self._wake.set()
+
+    def expect(self, folder, name, new_name):
+        with self._lock:
+            self._expected.setdefault(folder, []).append((name, new_name))
+
+    def close(self):
+        super().close()
+        self._wake.set()
+
+    def _list(self, folder):
+        entries = {}
+        with os.scandir(os.path.join(self.base, folder)) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    stat = entry.stat(follow_symlinks=False)
+                    identity = (entry.inode(), is_dir, 0 if is_dir else stat.st_size, stat.st_mtime_ns)
+                except OSError:
+                    continue
+                entries[entry.name + ("/" if is_dir else "")] = identity
+        return entries
+
+    def _expected_only(self, folder, entries):
+        """Apply the app's expected renames to a listing if they are all that changed
+
+        Returns the updated listing and the renames, or None if the folder
+        has other changes (or renames still to come) and must be listed.
+        """
+        with self._lock:
+            expected = list(self._expected.get(folder, ()))
+        if not expected:
+            return None
+        listing = dict(entries)
+        renames = []
+        for name, new_name in expected:
+            if name in listing and new_name not in listing:
+                listing[new_name] = listing.pop(name)
+                renames.append((name, new_name))
+        # Names only: one directory read, no stat calls
+        names = {name.rstrip("/") for name in listing}
+        if not renames or set(os.listdir(os.path.join(self.base, folder))) != names:
+            return None
+        with self._lock:
+            pending = self._expected.get(folder, [])
+            for rename in renames:
+                if rename in pending:
+                    pending.remove(rename)
+            if not pending:
+                self._expected.pop(folder, None)
+        return listing, renames
+
+    def _forget_expected(self, folder, listing):
+        """Drop expected renames the listing shows have happened (or never will)"""
+        with self._lock:
+            pending = [(name, new_name) for name, new_name in self._expected.get(folder, ())
+                       if name in listing]
+            if pending:
+                self._expected[folder] = pending
+            else:
+                self._expected.pop(folder, None)
+
+    def _run(self):
+        """Watcher thread: compare changed folders with their last listing"""
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            with self._lock:
+                new, self._new = self._new, []
+            events = []
+            for folder, mtime in new:
+                try:
+                    current = os.stat(os.path.join(self.base, folder)).st_mtime_ns
+                    self._folders[folder] = (current, self._list(folder))
+                except OSError:
+                    continue
+                if mtime is not None and current != mtime:
+                    events.append(("rescan", folder))
+
+            deleted = {}
+            created = []
+            rewritten = []
+            for folder, (mtime, entries) in list(self._folders.items()):
+                try:
+                    current = os.stat(os.path.join(self.base, folder)).st_mtime_ns
+                    if current == mtime:
+                        continue
+                    own = self._expected_only(folder, entries)
+                    if own is not None:
+                        listing, renames = own
+                        self._folders[folder] = (current, listing)
+                        events += [("renamed", folder, name, folder, new_name) for name, new_name in renames]
+                        continue
+                    listing = self._list(folder)
+                except OSError:
+                    del self._folders[folder]
+                    events.append(("rescan", folder))
+                    continue
+                self._folders[folder] = (current, listing)
+                self._forget_expected(folder, listing)
+                for name in entries.keys() - listing.keys():
+                    deleted[entries[name]] = (folder, name)
+                for name in listing.keys() - entries.keys():
+                    created.append((folder, name, listing[name]))
+                # Same name, different size or mtime (or a new file saved over it)
+                for name in entries.keys() & listing.keys():
+                    if not name.endswith("/") and listing[name] != entries[name]:
+                        rewritten.append((folder, name, listing[name]))
+
+            # Pair up renames by identity; the rest were really created or deleted
+            for folder, name, identity in created:
+                source = deleted.pop(identity, None)
+                if source is None:
+                    events.append(("created", folder, name))
+                else:
+                    events.append(("renamed", source[0], source[1], folder, name))
+            for folder, name, identity in rewritten:
+                source = deleted.pop(identity, None)
+                if source is None:
+                    events.append(("modified", folder, name))
+                else:
+                    # Moved over an existing file
+                    events.append(("renamed", source[0], source[1], folder, name))
+            events += [("deleted", folder, name) for folder, name in deleted.values()]
+            self._emit(events)
+
+
+def create_watcher(base, interval=2.0):
+    """Watch with inotify where available, otherwise by polling every interval seconds"""
+    libc = _load_libc()
+    if libc is not None:
+        try:
+            return InotifyWatcher(base, libc)
+        except OSError as e:
+            print(f"Error starting inotify, polling instead: {str(e)}")
+    return PollingWatcher(base, interval)
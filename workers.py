@@ -0,0 +1,182 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+
+def default_workers():
+    """All cores but one, which is left for the window and the prefetcher"""
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+class ProcessJob:
+    """Runs a task over queued items in a pool of worker processes
+
+    submit() queues (key, value) pairs; a feeder thread hands the values
+    to task(values, *args) in the worker processes a chunk at a time,
+    keeping only a couple of chunks per worker in flight so that stop()
+    takes effect quickly. task returns one result per value. The Tk main
+    thread polls take() for the (key, result) pairs finished since the
+    last call. The pool is started on first use and kept until shutdown(),
+    and replaced if a worker process dies. task must be a module-level
+    function so the workers can import it.
+    """
+
+    def __init__(self, task, args=(), workers=0, chunk_size=16, name="process-job"):
+        self.task = task
+        self.args = tuple(args)
+        self.workers = workers or default_workers()
+        self.chunk_size = chunk_size
+        self.name = name
+        self.done = 0
+        self.total = 0
+        self._queue = []                # (key, value) waiting for a worker
+        self._results = []              # (key, result) not taken yet
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._generation = 0            # Bumped by stop() to drop chunks in flight
+        self._executor = None
+        self._in_flight = {}            # Maps futures to (chunk, generation, alone)
+        self._thread = None
+        self._closed = False
+
+    def submit(self, items):
+        """Queue (key, value) pairs"""
+        if self._closed:
+            return
+        with self._lock:
+            self._queue.extend(items)
+            self.total += len(items)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def take(self):
+        """Take the (key, result) pairs finished since the last call (main thread)"""
+        with self._lock:
+            results, self._results = self._results, []
+        return results
+
+    def is_running(self):
+        with self._lock:
+            return self.done < self.total
+
+    def crashed(self, value, error):
+        """Result for a value whose worker process died while handling it"""
+        return {"error": f"The worker process crashed on this file ({error})"}
+
+    def stop(self):
+        """Drop queued items and ignore results of chunks in flight"""
+        with self._lock:
+            self._queue = []
+            self._results = []
+            self._generation += 1
+            self.done = 0
+            self.total = 0
+
+    def shutdown(self):
+        """Stop and end the worker processes"""
+        self.stop()
+        self._closed = True
+        self._wake.set()
+        with self._lock:
+            # Queued chunks are cancelled by hand; cancel_futures needs Python 3.9
+            for future in self._in_flight:
+                future.cancel()
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+
+    def _next_chunk(self, suspects):
+        """Take the next chunk to run: a lone suspect, or chunk_size queued items"""
+        with self._lock:
+            generation = self._generation
+            while suspects:
+                item, item_generation = suspects.pop(0)
+                if item_generation == generation:
+                    return [item], generation, True
+            chunk = self._queue[:self.chunk_size]
+            self._queue = self._queue[self.chunk_size:]
+            return chunk, generation, False
+
+    def _submit(self, chunk, generation, alone):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("shut down")
+            if self._executor is None:
+                # Spawned, not forked: the app's threads and Tk must not be copied
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            future = self._executor.submit(self.task, [value for _, value in chunk], *self.args)
+            self._in_flight[future] = (chunk, generation, alone)
+
+    def _restart(self):
+        """Replace a pool that lost a worker; the next chunk starts a new one"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def _run(self):
+        """Feeder thread: keep the worker processes busy until the queue is empty
+
+        When a worker process dies (a decoder crash, or the system running
+        out of memory), every chunk in flight is lost. Their items are run
+        again one at a time in a new pool, so the item that crashes a
+        worker again is known and gets a crashed() result; the rest of the
+        queue carries on.
+        """
+        suspects = []                   # (item, generation) from chunks lost with a worker
+        try:
+            while not self._closed:
+                # A couple of chunks per worker: enough to keep them busy, few to drop
+                # on stop(). Suspects run alone so that a crash can be pinned on one item.
+                while len(self._in_flight) < self.workers * 2:
+                    if suspects and self._in_flight:
+                        break
+                    chunk, generation, alone = self._next_chunk(suspects)
+                    if not chunk:
+                        break
+                    try:
+                        self._submit(chunk, generation, alone)
+                    except BrokenProcessPool:
+                        self._restart()
+                        suspects.extend((item, generation) for item in chunk)
+                        break
+                    if alone:
+                        break
+
+                if not self._in_flight:
+                    if suspects:
+                        continue
+                    self._wake.wait()
+                    self._wake.clear()
+                    continue
+
+                finished, _ = wait(list(self._in_flight), timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    with self._lock:
+                        chunk, generation, alone = self._in_flight.pop(future)
+                    if future.cancelled():
+                        continue
+                    try:
+                        results = future.result()
+                    except BrokenProcessPool as e:
+                        self._restart()
+                        if not alone:
+                            suspects.extend((item, generation) for item in chunk)
+                            continue
+                        print(f"Error in {self.name} workers: {chunk[0][1]}: {str(e)}")
+                        results = [self.crashed(chunk[0][1], e)]
+                    with self._lock:
+                        if generation == self._generation:
+                            self._results.extend(zip((key for key, _ in chunk), results))
+                            self.done += len(chunk)
+        except RuntimeError:
+            # The pool or the interpreter is shutting down
+            with self._lock:
+                self._queue = []
+                self.done = self.total
+        finally:
+            self._thread = None